@@ -0,0 +1,69 @@
+import threading
+
+from typing import Optional
+
+
+class BatchSizeController:
+    """Picks the size of the next batch of a sink from the batches it drained
+
+    Every drained batch reports its lookup and write latency, payload size and number of
+    failed records. The per record latency and payload size are smoothed (EWMA), and the
+    next size is the one expected to take `target_latency` seconds, capped so a batch holds
+    at most `max_bytes` of payload. A batch whose error rate exceeds `max_error_rate` halves
+    the size instead (throttling and timeouts cost less on smaller batches). The size grows
+    at most twofold per batch and always stays within `[min_size, max_size]`.
+    """
+
+    # weight of the latest batch in the smoothed per record figures
+    smoothing = 0.5
+
+    def __init__(
+        self,
+        min_size: int,
+        max_size: int,
+        initial_size: Optional[int] = None,
+        target_latency: float = 60.0,
+        max_bytes: Optional[int] = None,
+        max_error_rate: float = 0.2
+    ) -> None:
+        self.min_size = max(int(min_size), 1)
+        self.max_size = max(int(max_size), self.min_size)
+        self.target_latency = float(target_latency)
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.max_error_rate = float(max_error_rate)
+        self._size = self._clamp(initial_size or self.min_size)
+        self._seconds_per_record = None
+        self._bytes_per_record = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def observe(self, records: int, lookup_seconds: float, write_seconds: float, payload_bytes: int = 0, errors: int = 0) -> int:
+        """Records the cost of a drained batch and returns the size of the next one"""
+        if records <= 0:
+            return self._size
+
+        with self._lock:
+            self._seconds_per_record = self._smooth(self._seconds_per_record, (lookup_seconds + write_seconds) / records)
+            self._bytes_per_record = self._smooth(self._bytes_per_record, payload_bytes / records)
+
+            if errors / records > self.max_error_rate:
+                size = self._size // 2
+            else:
+                size = self.target_latency / self._seconds_per_record if self._seconds_per_record > 0 else self.max_size
+                if self.max_bytes and self._bytes_per_record > 0:
+                    size = min(size, self.max_bytes / self._bytes_per_record)
+                size = min(size, self._size * 2)
+
+            self._size = self._clamp(size)
+            return self._size
+
+    def _smooth(self, current: Optional[float], value: float) -> float:
+        if current is None:
+            return value
+        return self.smoothing * value + (1 - self.smoothing) * current
+
+    def _clamp(self, size: float) -> int:
+        return min(max(int(size), self.min_size), self.max_size)
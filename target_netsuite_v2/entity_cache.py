@@ -0,0 +1,112 @@
+import threading
+
+from collections import OrderedDict
+from typing import Optional
+
+
+class EntityCache:
+    """Run scoped, size bounded LRU cache of entity rows (vendors, customers, items, employees)
+
+    Rows are keyed by record type, lookup dimension and value, the dimensions being the
+    filters of `SuiteTalkRestClient.get_reference_data`. Only lookups that found rows are
+    cached, so an entity missing from NetSuite is queried again on the next batch.
+    """
+
+    # get_reference_data filter -> row field
+    dimensions = {
+        "record_ids": "internalId",
+        "external_ids": "externalId",
+        "names": "name",
+        "entity_ids": "entityId",
+        "item_ids": "itemId"
+    }
+
+    def __init__(self, max_size: int = 50000) -> None:
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._keys_by_internal_id = {}
+        self._internal_ids_by_key = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(record_type: str, dimension: str, value) -> tuple:
+        # ids are compared as strings, SuiteQL returns them as strings but records may hold integers
+        if dimension == "internalId":
+            value = str(value)
+        return (record_type, dimension, value)
+
+    def get(self, record_type: str, dimension: str, value) -> Optional[list]:
+        key = self._key(record_type, dimension, value)
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is not None:
+                self._entries.move_to_end(key)
+            return rows
+
+    def put(self, record_type: str, rows: list, names: Optional[set] = None) -> None:
+        """Caches rows under every unique key they hold
+
+        A name can be shared by several entities, so rows are only cached by name for the
+        `names` that were looked up (every row with that name was fetched).
+        """
+        with self._lock:
+            for row in rows:
+                self._set_unique_keys(record_type, row)
+
+            if names is not None:
+                rows_by_name = {}
+                for row in rows:
+                    if row.get("name") in names:
+                        rows_by_name.setdefault(row["name"], []).append(row)
+                for name, name_rows in rows_by_name.items():
+                    self._set(self._key(record_type, "name", name), name_rows, *name_rows)
+
+            self._evict()
+
+    def add(self, record_type: str, row: dict) -> None:
+        """Caches the row of a new entity, it is added to the cached rows sharing its name"""
+        with self._lock:
+            self._set_unique_keys(record_type, row)
+
+            if row.get("name"):
+                key = self._key(record_type, "name", row["name"])
+                name_rows = [*self._entries.get(key, ()), row]
+                self._set(key, name_rows, *name_rows)
+
+            self._evict()
+
+    def invalidate(self, record_type: str, internal_id) -> None:
+        with self._lock:
+            for key in list(self._keys_by_internal_id.get((record_type, str(internal_id)), ())):
+                self._remove(key)
+
+    def _set_unique_keys(self, record_type: str, row: dict) -> None:
+        for dimension in ("internalId", "externalId", "entityId", "itemId"):
+            if row.get(dimension):
+                self._set(self._key(record_type, dimension, row[dimension]), [row], row)
+
+    def _set(self, key: tuple, rows: list, *owners) -> None:
+        self._unlink(key)
+        self._entries[key] = rows
+        self._entries.move_to_end(key)
+        owner_ids = {(key[0], str(owner["internalId"])) for owner in owners if owner.get("internalId")}
+        for owner_id in owner_ids:
+            self._keys_by_internal_id.setdefault(owner_id, set()).add(key)
+        self._internal_ids_by_key[key] = owner_ids
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+        self._unlink(key)
+
+    def _unlink(self, key: tuple) -> None:
+        # drops the key from the index of the entities it was cached for, so the index stays bounded
+        for owner_id in self._internal_ids_by_key.pop(key, ()):
+            keys = self._keys_by_internal_id.get(owner_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_internal_id[owner_id]
@@ -0,0 +1,71 @@
+import random
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class RequestGovernor:
+    """Keeps the number of in flight NetSuite requests within the account concurrency limit
+
+    NetSuite rejects requests above the concurrency limit of the account (429 or
+    CONCURRENCY_LIMIT_EXCEEDED), so every request takes a slot before being sent.
+    Wait time, throttled responses and retries are tracked per endpoint.
+    """
+
+    def __init__(self, concurrency_limit: int, backoff_base: float = 1.0, backoff_max: float = 60.0) -> None:
+        self.concurrency_limit = max(int(concurrency_limit), 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = threading.BoundedSemaphore(self.concurrency_limit)
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(lambda: {"requests": 0, "throttled": 0, "retries": 0, "wait_time": 0.0})
+
+    @contextmanager
+    def slot(self, endpoint: str):
+        start = time.monotonic()
+        self._semaphore.acquire()
+        self.record(endpoint, requests=1, wait_time=time.monotonic() - start)
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    def record(self, endpoint: str, **counters) -> None:
+        with self._lock:
+            metrics = self._metrics[endpoint]
+            for key, value in counters.items():
+                metrics[key] += value
+
+    @property
+    def metrics(self) -> dict:
+        with self._lock:
+            return {endpoint: dict(metrics) for endpoint, metrics in self._metrics.items()}
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before the next attempt, `Retry-After` wins over the jittered exponential delay"""
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.backoff_max)
+
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return (retry_at - datetime.now(timezone.utc)).total_seconds()
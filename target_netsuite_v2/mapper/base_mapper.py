@@ -1,5 +1,7 @@
 import re
 
+from target_netsuite_v2.reference_data import ReferenceData, ReferenceIndex
+
 class InvalidInputError(Exception):
     pass
 
@@ -73,53 +75,46 @@ class BaseMapper:
             3. If the ingested record has an "externalId" field, and no "id" was provided, we look for a record in the reference data whose "externalId" matches the record "externalId"
         """
 
+        index = self._reference_index(reference_list)
+
         if record_id := self.record.get("id"):
             # Try matching internal ID first
-            found_record = next(
-                (record for record in reference_list
-                if str(record["internalId"]) == str(record_id)),
-                None
-            )
+            found_record = index.find_by_internal_id_str(record_id)
             if found_record:
                 return found_record
 
             # Try matching external ID if internal ID match failed
-            return next(
-                (record for record in reference_list
-                if record.get("externalId") == record_id),
-                None
-            )
+            return index.find("externalId", record_id)
 
         for record_extra_pk_mapping in self.record_extra_pk_mappings:
             if record_id := self.record.get(record_extra_pk_mapping["record_field"]):
-                found_record = next(
-                    (netsuite_record for netsuite_record in reference_list
-                    if netsuite_record.get(record_extra_pk_mapping["netsuite_field"]) == record_id),
-                    None
-                )
+                found_record = index.find(record_extra_pk_mapping["netsuite_field"], record_id)
 
                 if found_record:
                     return found_record
 
         # If no ID provided, try matching by external ID
         if external_id := self.record.get("externalId"):
-            return next(
-                (record for record in reference_list
-                if record.get("externalId") == external_id),
-                None
-            )
+            return index.find("externalId", external_id)
 
         return None
 
+    def _reference_index(self, reference_list) -> ReferenceIndex:
+        """Returns the lookup index of a reference list, built once per batch"""
+        if isinstance(self.reference_data, ReferenceData):
+            return self.reference_data.index_for(reference_list)
+        return ReferenceIndex(reference_list)
+
     def _find_subsidiaries(self, main_field, ref_field):
         reference_list = self.reference_data["Subsidiaries"]
 
+        index = self._reference_index(reference_list)
         matches = set()
         missing_references = []
 
         direct_ids = self.record.get(main_field, [])
         for direct_id in direct_ids:
-            found = next((item for item in reference_list if item["internalId"] == direct_id), None)
+            found = index.find("internalId", direct_id)
             if found:
                 matches.add(found["internalId"])
             else:
@@ -132,11 +127,11 @@ class BaseMapper:
             found = None
 
             if ref_id:
-                found = next((item for item in reference_list if item["internalId"] == ref_id), None)
+                found = index.find("internalId", ref_id)
             if found:
                 matches.add(found["internalId"])
             elif ref_name:
-                found = next((item for item in reference_list if item.get("name") == ref_name), None)
+                found = index.find("name", ref_name)
                 if found:
                     matches.add(found["internalId"])
 
@@ -162,99 +157,52 @@ class BaseMapper:
         Returns:
             dict|None: Matching reference object or None if not found
         """
+        index = self._reference_index(reference_list)
         found = None
         ref_name = None
         # Check for direct ID field first
         if direct_id := self.record.get(id_field):
-            found = next(
-                (item for item in reference_list if item["internalId"] == direct_id),
-                None
-            )
+            found = index.find("internalId", direct_id)
 
         if found:
             return found
 
         # If no match by id, try to find by reference name and subsidiary scope if provided.
         if name_field and (ref_name := self.record.get(name_field)):
-            found = next(
-                (
-                    item
-                    for item in reference_list
-                    if item.get("name") == ref_name and
-                    (subsidiary_scope is None or subsidiary_scope in item.get("subsidiaryId", "").replace(" ", "").split(","))
-                ),
-                None
-            )
+            found = index.find("name", ref_name, subsidiary_scope)
 
         if found:
             return found
         
         if item_id_field and (item_id := self.record.get(item_id_field)):
-            found = next(
-                (
-                    item
-                    for item in reference_list
-                    if item.get("itemId") == item_id and
-                    (subsidiary_scope is None or subsidiary_scope in item.get("subsidiaryId", "").replace(" ", "").split(","))
-                ),
-                None
-            )
+            found = index.find("itemId", item_id, subsidiary_scope)
 
         if found:
             return found
         
         # If no match by external id.
         if external_id_field and (external_id := self.record.get(external_id_field)):
-            found = next(
-                (
-                    item
-                    for item in reference_list
-                    if item.get("externalId") == external_id
-                ),
-                None
-            )
+            found = index.find("externalId", external_id)
 
         if found:
             return found
         
         if tran_id_field and (tran_id := self.record.get(tran_id_field)):
-            found = next(
-                (
-                    item
-                    for item in reference_list
-                    if item.get("tranId") == tran_id
-                ),
-                None
-            )
+            found = index.find("tranId", tran_id)
 
         if found:
             return found
 
          # Find by entity id.
         if entity_id_field and (entity_id := self.record.get(entity_id_field)):
-            found = next(
-                (
-                    item
-                    for item in reference_list
-                    if item.get("entityId") == entity_id
-                ),
-                None
-            )
+            found = index.find("entityId", entity_id)
 
         if found:
             return found
 
         # If no match by id or name, try to find by number
         if number_field and (ref_number := self.record.get(number_field)):
-            found = next(
-                (
-                    item
-                    for item in reference_list
-                    if item.get("number") == ref_number and
-                    (subsidiary_scope is None or subsidiary_scope in item.get("subsidiaryId", "").replace(" ", "").split(","))
-                ),
-                None
-            )
+            found = index.find("number", ref_number, subsidiary_scope)
 
         if found:
             return found
@@ -302,12 +250,13 @@ class BaseMapper:
         Returns:
             list[dict]: List of matching reference objects. Raises an error if any reference is not found.
         """
+        index = self._reference_index(reference_list)
         matches = set()
         missing_references = []
 
         direct_ids = self.record.get(main_field, [])
         for direct_id in direct_ids:
-            found = next((item for item in reference_list if item["internalId"] == direct_id), None)
+            found = index.find("internalId", direct_id)
             if found:
                 matches.add(found["internalId"])
             else:
@@ -320,11 +269,11 @@ class BaseMapper:
             found = None
 
             if ref_id:
-                found = next((item for item in reference_list if item["internalId"] == ref_id), None)
+                found = index.find("internalId", ref_id)
             if found:
                 matches.add(found["internalId"])
             elif ref_name:
-                found = next((item for item in reference_list if item.get("name") == ref_name), None)
+                found = index.find("name", ref_name)
                 if found:
                     matches.add(found["internalId"])
 
@@ -341,35 +290,26 @@ class BaseMapper:
 
     def _find_existing_currency(self):
         """Find a currency in the reference data by searching by symbol, name, or ID."""
-        reference_list = self.reference_data["Currencies"]
+        index = self._reference_index(self.reference_data["Currencies"])
 
         found = None
         # Check for direct ID field first
         if direct_id := self.record.get("currencyId"):
-            found = next(
-                (item for item in reference_list if item["internalId"] == direct_id),
-                None
-            )
+            found = index.find("internalId", direct_id)
 
         if found:
             return found
 
         # If no match by id, try to find by name
         if ref_name := self.record.get("currencyName"):
-            found = next(
-                (item for item in reference_list if item["name"] == ref_name),
-                None
-            )
+            found = index.find("name", ref_name)
 
         if found:
             return found
 
         # If no match by id, or name try to find by symbol
         if ref_symbol := self.record.get("currency"):
-            found = next(
-                (item for item in reference_list if item["symbol"] == ref_symbol),
-                None
-            )
+            found = index.find("symbol", ref_symbol)
 
         if found:
             return found
@@ -585,14 +525,7 @@ class BaseMapper:
         Returns:
             A dict containing the tax details line
         """
-        tax = next(
-                (
-                    item
-                    for item in self.reference_data["Taxes"]
-                    if item.get("name") == tax_code
-                ),
-                None
-            )
+        tax = self._reference_index(self.reference_data["Taxes"]).find("name", tax_code)
         if not tax:
             raise InvalidReferenceError(f"Unable to find tax code: {tax_code}")
 
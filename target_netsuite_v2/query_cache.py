@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from contextlib import closing
+from typing import Dict, List, Optional
+
+
+class QueryCache:
+    """Disk backed cache of SuiteQL lookup results, shared across batches and runs
+
+    Results are cached per lookup key: the record type, a fingerprint of the selected
+    columns, the row field the lookup filters on and the key value. Every key maps to the
+    rows it matched. Keys that matched nothing aren't cached, so a record created since is
+    found by the next lookup. Entries expire after the TTL of their record type and are
+    dropped when a record they hold, or one of their key values, is written.
+    """
+
+    def __init__(self, path: str, ttl: float, ttls: Optional[Dict[str, float]] = None) -> None:
+        self.path = path
+        self.ttl = float(ttl)
+        self.ttls = {record_type.lower(): float(value) for record_type, value in (ttls or {}).items()}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per operation, lookups run from several threads
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "record_type TEXT, columns TEXT, field TEXT, key TEXT, rows TEXT, cached_at REAL, "
+            "PRIMARY KEY (record_type, columns, field, key))"
+        )
+        connection.execute("CREATE TABLE IF NOT EXISTS entry_ids (internal_id TEXT, entry INTEGER)")
+        connection.execute("CREATE INDEX IF NOT EXISTS entry_ids_internal_id ON entry_ids (internal_id)")
+        connection.execute("CREATE INDEX IF NOT EXISTS entry_ids_entry ON entry_ids (entry)")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_key ON entries (key)")
+        return connection
+
+    @staticmethod
+    def fingerprint(columns: str) -> str:
+        return hashlib.sha1(columns.encode()).hexdigest()[:16]
+
+    def ttl_for(self, record_type: str) -> float:
+        return self.ttls.get(record_type.lower(), self.ttl)
+
+    def get_many(self, record_type: str, columns: str, field: str, keys: List[str]) -> Dict[str, list]:
+        """Returns the rows of the keys cached within the TTL of the record type"""
+        record_type = record_type.lower()
+        ttl = self.ttl_for(record_type)
+        if not keys or ttl <= 0:
+            return {}
+        min_cached_at = time.time() - ttl
+
+        hits = {}
+        with closing(self._connect()) as connection:
+            # stay well below SQLite's bound parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" for _ in chunk)
+                cursor = connection.execute(
+                    f"SELECT key, rows FROM entries WHERE record_type = ? AND columns = ? AND field = ? "
+                    f"AND cached_at >= ? AND key IN ({placeholders})",
+                    (record_type, columns, field, min_cached_at, *chunk)
+                )
+                for key, rows in cursor:
+                    hits[key] = json.loads(rows)
+        return hits
+
+    def put_many(self, record_type: str, columns: str, field: str, rows_by_key: Dict[str, list]) -> None:
+        record_type = record_type.lower()
+        if not rows_by_key or self.ttl_for(record_type) <= 0:
+            return
+
+        cached_at = time.time()
+        with closing(self._connect()) as connection, connection:
+            for key, rows in rows_by_key.items():
+                self._delete_entries(connection, [
+                    rowid for (rowid,) in connection.execute(
+                        "SELECT rowid FROM entries WHERE record_type = ? AND columns = ? AND field = ? AND key = ?",
+                        (record_type, columns, field, key)
+                    )
+                ])
+                cursor = connection.execute(
+                    "INSERT INTO entries (record_type, columns, field, key, rows, cached_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (record_type, columns, field, key, json.dumps([dict(row) for row in rows]), cached_at)
+                )
+                connection.executemany(
+                    "INSERT INTO entry_ids (internal_id, entry) VALUES (?, ?)",
+                    [(str(row["internalId"]), cursor.lastrowid) for row in rows if row.get("internalId") is not None]
+                )
+
+    def invalidate(self, internal_ids=(), keys=()) -> None:
+        """Drops the entries holding one of the records or cached under one of the key values
+
+        Record types aren't compared, the REST record type of a write doesn't always match the
+        record type of the lookups, so an unrelated entry sharing an id or key is dropped too.
+        """
+        internal_ids = [str(internal_id) for internal_id in internal_ids if internal_id is not None]
+        keys = [str(key) for key in keys if key is not None]
+        if not internal_ids and not keys:
+            return
+
+        with closing(self._connect()) as connection, connection:
+            rowids = set()
+            if internal_ids:
+                placeholders = ",".join("?" for _ in internal_ids)
+                cursor = connection.execute(f"SELECT entry FROM entry_ids WHERE internal_id IN ({placeholders})", internal_ids)
+                rowids.update(rowid for (rowid,) in cursor)
+            if keys:
+                placeholders = ",".join("?" for _ in keys)
+                cursor = connection.execute(f"SELECT rowid FROM entries WHERE key IN ({placeholders})", keys)
+                rowids.update(rowid for (rowid,) in cursor)
+            self._delete_entries(connection, list(rowids))
+
+    @staticmethod
+    def _delete_entries(connection: sqlite3.Connection, rowids: List[int]) -> None:
+        for start in range(0, len(rowids), 500):
+            chunk = rowids[start:start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            connection.execute(f"DELETE FROM entries WHERE rowid IN ({placeholders})", chunk)
+            connection.execute(f"DELETE FROM entry_ids WHERE entry IN ({placeholders})", chunk)
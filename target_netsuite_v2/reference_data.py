@@ -0,0 +1,279 @@
+import threading
+
+from collections.abc import Mapping
+from concurrent.futures import Future
+from typing import Iterable, Optional
+
+
+class ReferenceRow(Mapping):
+    """Read only reference row stored in `__slots__` instead of a dict
+
+    Rows with the same fields share a generated subclass (see `row_type`) holding the
+    field to slot mapping, so a row only stores its values. It reads like the dict it
+    replaces (`row["internalId"]`, `row.get("name")`, `dict(row)`), but isn't JSON
+    serializable, rows are converted with `dict(row)` before being written.
+    """
+
+    __slots__ = ()
+    _slots = {}
+    _row_types = {}
+    _row_types_lock = threading.Lock()
+
+    @classmethod
+    def row_type(cls, fields: tuple) -> type:
+        row_type = cls._row_types.get(fields)
+        if row_type is None:
+            with cls._row_types_lock:
+                row_type = cls._row_types.get(fields)
+                if row_type is None:
+                    slots = tuple(f"_{position}" for position in range(len(fields)))
+                    row_type = type("ReferenceRow", (cls,), {"__slots__": slots, "_slots": dict(zip(fields, slots))})
+                    cls._row_types[fields] = row_type
+        return row_type
+
+    @classmethod
+    def from_pairs(cls, pairs: list) -> "ReferenceRow":
+        row_type = cls.row_type(tuple(key for key, _ in pairs))
+        row = row_type.__new__(row_type)
+        for slot, (_, value) in zip(row_type.__slots__, pairs):
+            setattr(row, slot, value)
+        return row
+
+    def __getitem__(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            raise KeyError(key)
+        return getattr(self, slot)
+
+    def get(self, key, default=None):
+        slot = self._slots.get(key)
+        if slot is None:
+            return default
+        return getattr(self, slot)
+
+    def __contains__(self, key) -> bool:
+        return key in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+def compact_rows(rows: Iterable[Mapping]) -> list:
+    """Converts reference rows (e.g. read from a snapshot) to `ReferenceRow`s"""
+    return [row if isinstance(row, ReferenceRow) else ReferenceRow.from_pairs(list(row.items())) for row in rows]
+
+
+class ReferenceIndex:
+    """Hash indexes over a list of reference rows (e.g. Accounts, Items)
+
+    Every key field maps a value to the first row holding it, which mirrors the `next(...)`
+    scans the mappers used to do. Fields used in subsidiary scoped lookups also keep every
+    candidate row with its precomputed set of subsidiary ids. Rows appended to the list after
+    the index was built (e.g. records created during the batch) are picked up by `refresh`.
+    """
+
+    key_fields = ("internalId", "externalId", "name", "entityId", "itemId", "tranId", "number", "symbol")
+    scoped_fields = ("name", "itemId", "number")
+
+    def __init__(self, rows: list) -> None:
+        self.rows = rows
+        self._size = 0
+        self._by_field = {field: {} for field in self.key_fields}
+        self._by_internal_id_str = {}
+        self._scoped = {field: {} for field in self.scoped_fields}
+        self.refresh()
+
+    def refresh(self) -> None:
+        rows = self.rows
+        size = len(rows)
+        for row in rows[self._size:size]:
+            self._add(row)
+        self._size = size
+
+    def _add(self, row) -> None:
+        for field, index in self._by_field.items():
+            value = row.get(field)
+            if value is None:
+                continue
+            try:
+                index.setdefault(value, row)
+            except TypeError:
+                continue
+
+        internal_id = row.get("internalId")
+        if internal_id is not None:
+            self._by_internal_id_str.setdefault(str(internal_id), row)
+
+        subsidiaries = None
+        for field, index in self._scoped.items():
+            value = row.get(field)
+            if value is None:
+                continue
+            if subsidiaries is None:
+                subsidiaries = self.subsidiary_ids(row)
+            try:
+                index.setdefault(value, []).append((row, subsidiaries))
+            except TypeError:
+                continue
+
+    @staticmethod
+    def subsidiary_ids(row) -> frozenset:
+        subsidiary_id = row.get("subsidiaryId")
+        if subsidiary_id is None:
+            return frozenset([""])
+        return frozenset(str(subsidiary_id).replace(" ", "").split(","))
+
+    def find(self, field: str, value, subsidiary_scope: Optional[str] = None):
+        """Returns the first row whose `field` equals `value` and, when a scope is given, belongs to that subsidiary"""
+        if field not in self._by_field or (subsidiary_scope is not None and field not in self._scoped):
+            return self._scan(field, value, subsidiary_scope)
+
+        try:
+            if subsidiary_scope is None:
+                return self._by_field[field].get(value)
+
+            for row, subsidiaries in self._scoped[field].get(value, ()):
+                if subsidiary_scope in subsidiaries:
+                    return row
+            return None
+        except TypeError:
+            return self._scan(field, value, subsidiary_scope)
+
+    def find_by_internal_id_str(self, value):
+        """Returns the first row whose internalId matches `value` once both are converted to strings"""
+        return self._by_internal_id_str.get(str(value))
+
+    def _scan(self, field: str, value, subsidiary_scope: Optional[str] = None):
+        return next(
+            (
+                row
+                for row in self.rows
+                if row.get(field) == value and
+                (subsidiary_scope is None or subsidiary_scope in self.subsidiary_ids(row))
+            ),
+            None
+        )
+
+
+class ReferenceData(dict):
+    """The reference data of a batch, it builds a `ReferenceIndex` once per reference list
+
+    Tables missing from the batch are read from `parent`, the global reference data of the target.
+    """
+
+    def __init__(self, *args, parent: Optional[dict] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.parent = parent
+        self._indexes = {}
+        self._indexes_lock = threading.Lock()
+
+    def __missing__(self, key):
+        if self.parent is None:
+            raise KeyError(key)
+        value = self.parent[key]
+        self[key] = value
+        return value
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, key) or (self.parent is not None and key in self.parent)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def index_for(self, rows: list) -> ReferenceIndex:
+        with self._indexes_lock:
+            # the index holds a reference to the list, so its id can't be reused while it is cached
+            index = self._indexes.get(id(rows))
+            if index is None or index.rows is not rows:
+                index = ReferenceIndex(rows)
+                self._indexes[id(rows)] = index
+            else:
+                index.refresh()
+            return index
+
+
+class ReferenceTableUnavailable(Exception):
+    """Raised by a loader whose table couldn't be read, `rows` are returned for now but not memoized"""
+
+    def __init__(self, message: str, rows: Optional[list] = None) -> None:
+        super().__init__(message)
+        self.rows = rows if rows is not None else []
+
+
+class LazyReferenceData(dict):
+    """Global reference data whose tables are loaded the first time they are read
+
+    Tables are memoized for the rest of the run. `prefetch` starts loading tables in the
+    background, e.g. as soon as the stream that needs them is known, and a reader of a table
+    that is still loading waits for that load instead of starting another one. A loader
+    raising `ReferenceTableUnavailable` hands its fallback rows to the waiting readers, and
+    the table is loaded again the next time it is read.
+    """
+
+    def __init__(self, loaders: dict, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._loaders = loaders
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def __missing__(self, key):
+        if key not in self._loaders:
+            raise KeyError(key)
+        return self._load(key)
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, key) or key in self._loaders
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def prefetch(self, keys) -> None:
+        for key in keys:
+            if dict.__contains__(self, key) or key not in self._loaders:
+                continue
+            future, is_owner = self._future_for(key)
+            if is_owner:
+                threading.Thread(target=self._run_loader, args=(key, future), daemon=True).start()
+
+    def _load(self, key):
+        future, is_owner = self._future_for(key)
+        if is_owner:
+            self._run_loader(key, future)
+        return future.result()
+
+    def _future_for(self, key):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._futures[key] = future
+            return future, True
+
+    def _run_loader(self, key, future: Future) -> None:
+        try:
+            rows = self._loaders[key]()
+        except ReferenceTableUnavailable as e:
+            with self._lock:
+                self._futures.pop(key, None)
+            future.set_result(e.rows)
+            return
+        except BaseException as e:
+            with self._lock:
+                self._futures.pop(key, None)
+            future.set_exception(e)
+            return
+        dict.__setitem__(self, key, rows)
+        future.set_result(rows)
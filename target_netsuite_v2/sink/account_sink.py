@@ -5,8 +5,12 @@ from target_netsuite_v2.mapper.account_schema_mapper import AccountSchemaMapper
 class AccountSink(NetSuiteBatchSink):
     name = "Accounts"
     record_type = "account"
+    bulk_write_capable = True
+    entity_name_field = "acctName"
     unified_schema = Account
     auto_validate_unified_schema = True
+    global_reference_tables = ["Accounts", "Subsidiaries", "Locations", "Departments", "Classifications", "Currencies"]
+    parent_reference_fields = {"parentId": "id", "parentName": "name"}
 
     def preprocess_batch_record(self, record: dict, reference_data: dict) -> dict:
         return AccountSchemaMapper(record, self.name, reference_data).to_netsuite()
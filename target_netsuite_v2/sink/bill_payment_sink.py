@@ -8,6 +8,9 @@ class BillPaymentSink(NetSuiteBatchSink):
     record_type = "vendorPayment"
     unified_schema = BillPayment
     auto_validate_unified_schema = True
+    global_reference_tables = ["Currencies", "Accounts"]
+    upstream_streams = ["Bills", "Vendors", "Accounts"]
+    record_extra_pk_mappings = BillPaymentSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
@@ -37,7 +40,7 @@ class BillPaymentSink(NetSuiteBatchSink):
         vendor_entity_ids = {record["vendorNumber"] for record in raw_records if record.get("vendorNumber")}
         vendor_external_ids = {record["vendorExternalId"] for record in raw_records if record.get("vendorExternalId")}
         vendor_names = {record["vendorName"] for record in raw_records if record.get("vendorName")}
-        _, _, vendors = self.suite_talk_client.get_reference_data(
+        _, _, vendors = self.get_cached_reference_data(
             "vendor",
             record_ids=vendor_ids,
             external_ids=vendor_external_ids,
@@ -9,6 +9,9 @@ class BillSink(NetSuiteBatchSink):
     record_type = "vendorBill"
     unified_schema = Bill
     auto_validate_unified_schema = True
+    global_reference_tables = ["Currencies", "Subsidiaries", "Locations", "Departments", "Classifications", "Accounts", "Taxes"]
+    upstream_streams = ["Vendors", "Items", "Accounts"]
+    record_extra_pk_mappings = BillSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
@@ -16,24 +19,11 @@ class BillSink(NetSuiteBatchSink):
         external_ids = {record["externalId"] for record in raw_records if record.get("externalId")}
         tran_ids = {record["billNumber"] for record in raw_records if record.get("billNumber")}
         ids = {record["id"] for record in raw_records if record.get("id")}
-        _, _, bills = self.suite_talk_client.get_transaction_data(
-            transaction_type="VendBill",
-            external_ids=external_ids,
-            record_ids=ids,
-            tran_ids=tran_ids
-        )
 
         vendor_ids = {record["vendorId"] for record in raw_records if record.get("vendorId")}
         vendor_entity_ids = {record["vendorNumber"] for record in raw_records if record.get("vendorNumber")}
         vendor_names = {record["vendorName"] for record in raw_records if record.get("vendorName")}
         vendor_external_ids = {record["vendorExternalId"] for record in raw_records if record.get("vendorExternalId")}
-        _, _, vendors = self.suite_talk_client.get_reference_data(
-            "vendor",
-            record_ids=vendor_ids,
-            names=vendor_names,
-            external_ids=vendor_external_ids,
-            entity_ids=vendor_entity_ids
-        )
 
         item_record_ids = set()
         item_ids = set()
@@ -42,29 +32,51 @@ class BillSink(NetSuiteBatchSink):
             item_record_ids.update(line_item["itemId"] for line_item in record.get("lineItems", []) if line_item.get("itemId"))
             item_ids.update(line_item["itemNumber"] for line_item in record.get("lineItems", []) if line_item.get("itemNumber"))
             item_names.update(line_item["itemName"] for line_item in record.get("lineItems", []) if line_item.get("itemName"))
-        _, _, items = self.suite_talk_client.get_reference_data(
-            "item",
-            record_ids = item_record_ids,
-            names = item_names,
-            item_ids=item_ids
-        )
 
-        bill_ids = {bill["internalId"] for bill in bills}
-        _, _, bill_items = self.suite_talk_client.get_bill_items(
-            bill_ids
+        # the line and payment lookups select the bills through a subquery, so every lookup runs at once
+        bill_queries = self.suite_talk_client.get_transaction_id_queries(
+            transaction_type="VendBill",
+            external_ids=external_ids,
+            record_ids=ids,
+            tran_ids=tran_ids
         )
-        
-        _, _, bill_payments = self.suite_talk_client.get_bill_payments(
-            bill_ids=bill_ids
+
+        lookups = self.run_concurrent_lookups(
+            bills=lambda: self.suite_talk_client.get_transaction_data(
+                transaction_type="VendBill",
+                external_ids=external_ids,
+                record_ids=ids,
+                tran_ids=tran_ids
+            ),
+            vendors=lambda: self.get_cached_reference_data(
+                "vendor",
+                record_ids=vendor_ids,
+                names=vendor_names,
+                external_ids=vendor_external_ids,
+                entity_ids=vendor_entity_ids
+            ),
+            items=lambda: self.get_cached_reference_data(
+                "item",
+                record_ids = item_record_ids,
+                names = item_names,
+                item_ids=item_ids
+            ),
+            bill_items=lambda: self.suite_talk_client.get_bill_items(
+                None,
+                transaction_queries=bill_queries
+            ),
+            bill_payments=lambda: self.suite_talk_client.get_bill_payments(
+                transaction_queries=bill_queries
+            )
         )
 
         return {
             **self._target.reference_data,
-            "Bills": bills,
-            "Vendors": vendors,
-            "Items": items,
-            "BillItems": bill_items,
-            "BillPayments": bill_payments
+            "Bills": lookups["bills"],
+            "Vendors": lookups["vendors"],
+            "Items": lookups["items"],
+            "BillItems": lookups["bill_items"],
+            "BillPayments": lookups["bill_payments"]
         }
 
     def preprocess_batch_record(self, record: dict, reference_data: dict) -> dict:
@@ -189,22 +201,29 @@ class BillSink(NetSuiteBatchSink):
     def create_child_records(self, parent_id: int, record: dict, reference_data: dict):
         payments = record.get("relatedPayments", [])
 
-        created_ids = []
-        error_messages = []
+        # payments that can't be mapped keep their position, so errors are reported in payment order
+        results = []
+        preprocessed_payments = []
         for payment in payments:
             if self.check_payment_exists(parent_id, payment, reference_data):
                 continue
 
             try:
-                preprocessed_payment = BillPaymentSchemaMapper(payment, "BillPayments", record.get("entity"), parent_id, reference_data).to_netsuite()
-                id, success, error_message = self.suite_talk_client.create_record("vendorPayment", preprocessed_payment)
-                if not success:
-                    error_messages.append(f"Error creating payment for Bill: {error_message}")
-                else:
-                    created_ids.append(id)
+                preprocessed_payments.append(BillPaymentSchemaMapper(payment, "BillPayments", record.get("entity"), parent_id, reference_data).to_netsuite())
+                results.append(None)
             except InvalidInputError as e:
-                error_messages.append(f"Error creating payment for Bill: {str(e)}")
+                results.append((None, False, str(e)))
 
+        created = iter(self.create_records_concurrently("vendorPayment", preprocessed_payments))
+
+        created_ids = []
+        error_messages = []
+        for result in results:
+            id, success, error_message = result if result is not None else next(created)
+            if not success:
+                error_messages.append(f"Error creating payment for Bill: {error_message}")
+            else:
+                created_ids.append(id)
 
         return created_ids, len(error_messages) == 0, error_messages
 
@@ -5,19 +5,30 @@ from target_netsuite_v2.mapper.customer_schema_mapper import CustomerSchemaMappe
 class CustomerSink(NetSuiteBatchSink):
     name = "Customers"
     record_type = "customer"
+    bulk_write_capable = True
+    soap_record_type = "Customer"
     unified_schema = Customer
     auto_validate_unified_schema = True
+    entity_cache_record_type = "customer"
+    entity_name_field = "companyName"
+    global_reference_tables = ["Currencies", "Subsidiaries", "CustomerCategory"]
+    parent_reference_fields = {"parentId": "id", "parentName": "companyName", "parentNumber": "customerNumber"}
+    record_extra_pk_mappings = CustomerSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
+        # every customer is upserted by externalId, only their parents are looked up
+        skip_existence_lookup = self.can_skip_existence_lookup(raw_records, "customerNumber")
 
-        ids = {record["id"] for record in raw_records if record.get("id")}
-        ids.update(record["parentId"] for record in raw_records if record.get("parentId"))
-        external_ids = {record["externalId"] for record in raw_records if record.get("externalId")}
+        ids = {record["parentId"] for record in raw_records if record.get("parentId")}
         names = {record["parentName"] for record in raw_records if record.get("parentName")}
-        names.update({record["companyName"] for record in raw_records if record.get("companyName")})
-        entity_ids = {record["customerNumber"] for record in raw_records if record.get("customerNumber")}
-        entity_ids.update(record["parentNumber"] for record in raw_records if record.get("parentNumber"))
+        entity_ids = {record["parentNumber"] for record in raw_records if record.get("parentNumber")}
+        external_ids = set()
+        if not skip_existence_lookup:
+            ids.update(record["id"] for record in raw_records if record.get("id"))
+            external_ids = {record["externalId"] for record in raw_records if record.get("externalId")}
+            names.update({record["companyName"] for record in raw_records if record.get("companyName")})
+            entity_ids.update(record["customerNumber"] for record in raw_records if record.get("customerNumber"))
 
         _, _, customers = self.suite_talk_client.get_reference_data(
             self.record_type,
@@ -29,7 +40,7 @@ class CustomerSink(NetSuiteBatchSink):
 
         sales_rep_ids = {record["salesRepId"] for record in raw_records if record.get("salesRepId")}
         sales_rep_names = {record["salesRepName"] for record in raw_records if record.get("salesRepName")}
-        _, _, employees = self.suite_talk_client.get_reference_data(
+        _, _, employees = self.get_cached_reference_data(
             "employee",
             record_ids=sales_rep_ids,
             names=sales_rep_names
@@ -7,6 +7,9 @@ class InvoicePaymentSink(NetSuiteBatchSink):
     record_type = "customerPayment"
     unified_schema = InvoicePayment
     auto_validate_unified_schema = True
+    global_reference_tables = ["Currencies", "Accounts"]
+    upstream_streams = ["Invoices", "Customers", "Accounts"]
+    record_extra_pk_mappings = InvoicePaymentSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
@@ -36,7 +39,7 @@ class InvoicePaymentSink(NetSuiteBatchSink):
         customer_entity_ids = {record["customerNumber"] for record in raw_records if record.get("customerNumber")}
         customer_external_ids = {record["customerExternalId"] for record in raw_records if record.get("customerExternalId")}
         customer_names = {record["customerName"] for record in raw_records if record.get("customerName")}
-        _, _, customers = self.suite_talk_client.get_reference_data(
+        _, _, customers = self.get_cached_reference_data(
             "customer",
             record_ids=customer_ids,
             external_ids=customer_external_ids,
@@ -9,6 +9,9 @@ class InvoiceSink(NetSuiteBatchSink):
     record_type = "invoice"
     unified_schema = Invoice
     auto_validate_unified_schema = True
+    global_reference_tables = ["Currencies", "Subsidiaries", "Locations", "Departments", "Classifications", "Accounts", "Taxes"]
+    upstream_streams = ["Customers", "Items", "Accounts"]
+    record_extra_pk_mappings = InvoiceSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
@@ -16,22 +19,10 @@ class InvoiceSink(NetSuiteBatchSink):
         external_ids = {record["externalId"] for record in raw_records if record.get("externalId")}
         tran_ids = {record["invoiceNumber"] for record in raw_records if record.get("invoiceNumber")}
         ids = {record["id"] for record in raw_records if record.get("id")}
-        _, _, invoices = self.suite_talk_client.get_transaction_data(
-            transaction_type="CustInvc",
-            external_ids=external_ids,
-            record_ids=ids,
-            tran_ids=tran_ids
-        )
 
         customer_ids = {record["customerId"] for record in raw_records if record.get("customerId")}
         customer_entity_ids = {record["customerNumber"] for record in raw_records if record.get("customerNumber")}
         customer_names = {record["customerName"] for record in raw_records if record.get("customerName")}
-        _, _, customers = self.suite_talk_client.get_reference_data(
-            "customer",
-            record_ids=customer_ids,
-            names=customer_names,
-            entity_ids=customer_entity_ids
-        )
 
         item_record_ids = set()
         item_ids = set()
@@ -40,29 +31,50 @@ class InvoiceSink(NetSuiteBatchSink):
             item_record_ids.update(line_item["itemId"] for line_item in record.get("lineItems", []) if line_item.get("itemId"))
             item_ids.update(line_item["itemNumber"] for line_item in record.get("lineItems", []) if line_item.get("itemNumber"))
             item_names.update(line_item["itemName"] for line_item in record.get("lineItems", []) if line_item.get("itemName"))
-        _, _, items = self.suite_talk_client.get_reference_data(
-            "item",
-            record_ids = item_record_ids,
-            names = item_names,
-            item_ids=item_ids
-        )
 
-        invoice_ids = {invoice["internalId"] for invoice in invoices}
-        _, _, invoice_items = self.suite_talk_client.get_invoice_items(
-            invoice_ids
+        # the line and payment lookups select the invoices through a subquery, so every lookup runs at once
+        invoice_queries = self.suite_talk_client.get_transaction_id_queries(
+            transaction_type="CustInvc",
+            external_ids=external_ids,
+            record_ids=ids,
+            tran_ids=tran_ids
         )
 
-        _, _, invoice_payments = self.suite_talk_client.get_invoice_payments(
-            invoice_ids=invoice_ids
+        lookups = self.run_concurrent_lookups(
+            invoices=lambda: self.suite_talk_client.get_transaction_data(
+                transaction_type="CustInvc",
+                external_ids=external_ids,
+                record_ids=ids,
+                tran_ids=tran_ids
+            ),
+            customers=lambda: self.get_cached_reference_data(
+                "customer",
+                record_ids=customer_ids,
+                names=customer_names,
+                entity_ids=customer_entity_ids
+            ),
+            items=lambda: self.get_cached_reference_data(
+                "item",
+                record_ids = item_record_ids,
+                names = item_names,
+                item_ids=item_ids
+            ),
+            invoice_items=lambda: self.suite_talk_client.get_invoice_items(
+                None,
+                transaction_queries=invoice_queries
+            ),
+            invoice_payments=lambda: self.suite_talk_client.get_invoice_payments(
+                transaction_queries=invoice_queries
+            )
         )
 
         return {
             **self._target.reference_data,
-            "Invoices": invoices,
-            "Customers": customers,
-            "Items": items,
-            "InvoiceItems": invoice_items,
-            "InvoicePayments": invoice_payments
+            "Invoices": lookups["invoices"],
+            "Customers": lookups["customers"],
+            "Items": lookups["items"],
+            "InvoiceItems": lookups["invoice_items"],
+            "InvoicePayments": lookups["invoice_payments"]
         }
 
     def preprocess_batch_record(self, record: dict, reference_data: dict) -> dict:
@@ -151,21 +163,29 @@ class InvoiceSink(NetSuiteBatchSink):
     def create_child_records(self, parent_id: int, record: dict, reference_data: dict):
         payments = record.get("relatedPayments", [])
 
-        created_ids = []
-        error_messages = []
+        # payments that can't be mapped keep their position, so errors are reported in payment order
+        results = []
+        preprocessed_payments = []
         for payment in payments:
             if self.check_payment_exists(parent_id, payment, reference_data):
                 continue
 
             try:
-                preprocessed_payment = InvoicePaymentSchemaMapper(payment, "InvoicePayments", record.get("entity"), parent_id, reference_data).to_netsuite()
-                id, success, error_message = self.suite_talk_client.create_record("customerPayment", preprocessed_payment)
-                if not success:
-                    error_messages.append(f"Error creating payment for Invoice: {error_message}")
-                else:
-                    created_ids.append(id)
+                preprocessed_payments.append(InvoicePaymentSchemaMapper(payment, "InvoicePayments", record.get("entity"), parent_id, reference_data).to_netsuite())
+                results.append(None)
             except InvalidInputError as e:
-                error_messages.append(f"Error creating payment for Invoice: {str(e)}")
+                results.append((None, False, str(e)))
+
+        created = iter(self.create_records_concurrently("customerPayment", preprocessed_payments))
+
+        created_ids = []
+        error_messages = []
+        for result in results:
+            id, success, error_message = result if result is not None else next(created)
+            if not success:
+                error_messages.append(f"Error creating payment for Invoice: {error_message}")
+            else:
+                created_ids.append(id)
 
         return created_ids, len(error_messages) == 0, error_messages
 
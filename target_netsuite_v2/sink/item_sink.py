@@ -7,6 +7,9 @@ class ItemSink(NetSuiteBatchSink):
     record_type = "item"
     unified_schema = Item
     auto_validate_unified_schema = True
+    entity_cache_record_type = "item"
+    global_reference_tables = ["Subsidiaries", "Locations", "Departments", "Classifications"]
+    record_extra_pk_mappings = ItemSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
@@ -41,8 +44,10 @@ class ItemSink(NetSuiteBatchSink):
 
         if error_message:
             state["error"] = error_message
-        elif did_update:
-            state["is_updated"] = True
+        else:
+            self.cache_written_entity(id, record, created=not did_update)
+            if did_update:
+                state["is_updated"] = True
 
         return id, success, state
 
@@ -5,8 +5,13 @@ from target_netsuite_v2.mapper.journal_entry_schema_mapper import JournalEntrySc
 class JournalEntrySink(NetSuiteBatchSink):
     name = "JournalEntries"
     record_type = "journalEntry"
+    soap_record_type = "JournalEntry"
+    updates_existing_records = False
     unified_schema = JournalEntry
     auto_validate_unified_schema = True
+    global_reference_tables = ["Currencies", "Subsidiaries", "Locations", "Departments", "Classifications", "Accounts"]
+    upstream_streams = ["Accounts", "Customers", "Vendors"]
+    record_extra_pk_mappings = JournalEntrySchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
@@ -28,7 +33,7 @@ class JournalEntrySink(NetSuiteBatchSink):
             customer_ids.update(line_item["customerId"] for line_item in record.get("lineItems", []) if line_item.get("customerId"))
             customer_entity_ids.update(line_item["customerNumber"] for line_item in record.get("lineItems", []) if line_item.get("customerNumber"))
             customer_names.update(line_item["customerName"] for line_item in record.get("lineItems", []) if line_item.get("customerName"))
-        _, _, customers = self.suite_talk_client.get_reference_data(
+        _, _, customers = self.get_cached_reference_data(
             "customer",
             record_ids=customer_ids,
             names=customer_names,
@@ -42,7 +47,7 @@ class JournalEntrySink(NetSuiteBatchSink):
             vendor_ids.update(line_item["vendorId"] for line_item in record.get("lineItems", []) if line_item.get("vendorId"))
             vendor_entity_ids.update(line_item["vendorNumber"] for line_item in record.get("lineItems", []) if line_item.get("vendorNumber"))
             vendor_names.update(line_item["vendorName"] for line_item in record.get("lineItems", []) if line_item.get("vendorName"))
-        _, _, vendors = self.suite_talk_client.get_reference_data(
+        _, _, vendors = self.get_cached_reference_data(
             "vendor",
             record_ids=vendor_ids,
             names=vendor_names,
@@ -8,6 +8,9 @@ class PurchaseOrderSink(NetSuiteBatchSink):
     record_type = "purchaseOrder"
     unified_schema = PurchaseOrder
     auto_validate_unified_schema = True
+    global_reference_tables = ["Currencies", "Subsidiaries", "Locations", "Departments", "Classifications"]
+    upstream_streams = ["Vendors", "Customers", "Items"]
+    record_extra_pk_mappings = PurchaseOrderSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
@@ -26,7 +29,7 @@ class PurchaseOrderSink(NetSuiteBatchSink):
         vendor_external_ids = {record["vendorExternalId"] for record in raw_records if record.get("vendorExternalId")}
         vendor_numbers = {record["vendorNumber"] for record in raw_records if record.get("vendorNumber")}
         vendor_names = {record["vendorName"] for record in raw_records if record.get("vendorName")}
-        _, _, vendors = self.suite_talk_client.get_reference_data(
+        _, _, vendors = self.get_cached_reference_data(
             "vendor",
             record_ids=vendor_ids,
             external_ids=vendor_external_ids,
@@ -41,7 +44,7 @@ class PurchaseOrderSink(NetSuiteBatchSink):
             employee_ids.update(line_item["employeeId"] for line_item in record.get("lineItems", []) if line_item.get("employeeId"))
             employee_external_ids.update(line_item["employeeNumber"] for line_item in record.get("lineItems", []) if line_item.get("employeeNumber"))
             employee_names.update(line_item["employeeName"] for line_item in record.get("lineItems", []) if line_item.get("employeeName"))
-        _, _, employees = self.suite_talk_client.get_reference_data(
+        _, _, employees = self.get_cached_reference_data(
             "employee",
             record_ids=employee_ids,
             names=employee_names,
@@ -57,7 +60,7 @@ class PurchaseOrderSink(NetSuiteBatchSink):
             customer_names.update(line_item["projectName"] for line_item in record.get("lineItems", []) if line_item.get("projectName"))
             customer_entity_ids.update(line_item["projectNumber"] for line_item in record.get("lineItems", []) if line_item.get("projectNumber"))
             customer_external_ids.update(line_item["projectExternalId"] for line_item in record.get("lineItems", []) if line_item.get("projectExternalId"))
-        _, _, customers = self.suite_talk_client.get_reference_data(
+        _, _, customers = self.get_cached_reference_data(
             "customer",
             record_ids = customer_ids,
             names = customer_names,
@@ -74,7 +77,7 @@ class PurchaseOrderSink(NetSuiteBatchSink):
             item_ids.update(line_item["itemNumber"] for line_item in record.get("lineItems", []) if line_item.get("itemNumber"))
             item_names.update(line_item["itemName"] for line_item in record.get("lineItems", []) if line_item.get("itemName"))
             item_external_ids.update(line_item["itemExternalId"] for line_item in record.get("lineItems", []) if line_item.get("itemExternalId"))
-        _, _, items = self.suite_talk_client.get_reference_data(
+        _, _, items = self.get_cached_reference_data(
             "item",
             record_ids = item_record_ids,
             names = item_names,
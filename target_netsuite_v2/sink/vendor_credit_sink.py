@@ -7,6 +7,9 @@ class VendorCreditSink(NetSuiteBatchSink):
     record_type = "vendorCredit"
     unified_schema = VendorCredit
     auto_validate_unified_schema = True
+    global_reference_tables = ["Currencies", "Subsidiaries", "Locations", "Departments", "Classifications", "Accounts", "Taxes"]
+    upstream_streams = ["Vendors", "Items", "Accounts"]
+    record_extra_pk_mappings = VendorCreditSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
@@ -25,7 +28,7 @@ class VendorCreditSink(NetSuiteBatchSink):
         vendor_external_ids = {record["vendorExternalId"] for record in raw_records if record.get("vendorExternalId")}
         vendor_numbers = {record["vendorNumber"] for record in raw_records if record.get("vendorNumber")}
         vendor_names = {record["vendorName"] for record in raw_records if record.get("vendorName")}
-        _, _, vendors = self.suite_talk_client.get_reference_data(
+        _, _, vendors = self.get_cached_reference_data(
             "vendor",
             record_ids=vendor_ids,
             external_ids=vendor_external_ids,
@@ -42,7 +45,7 @@ class VendorCreditSink(NetSuiteBatchSink):
             item_ids.update(line_item["itemNumber"] for line_item in record.get("lineItems", []) if line_item.get("itemNumber"))
             item_names.update(line_item["itemName"] for line_item in record.get("lineItems", []) if line_item.get("itemName"))
             item_external_ids.update(line_item["itemExternalId"] for line_item in record.get("lineItems", []) if line_item.get("itemExternalId"))
-        _, _, items = self.suite_talk_client.get_reference_data(
+        _, _, items = self.get_cached_reference_data(
             "item",
             record_ids = item_record_ids,
             names = item_names,
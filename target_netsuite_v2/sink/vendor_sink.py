@@ -5,12 +5,26 @@ from target_netsuite_v2.mapper.vendor_schema_mapper import VendorSchemaMapper
 class VendorSink(NetSuiteBatchSink):
     name = "Vendors"
     record_type = "vendor"
+    bulk_write_capable = True
+    soap_record_type = "Vendor"
     unified_schema = Vendor
     auto_validate_unified_schema = True
+    entity_cache_record_type = "vendor"
+    entity_name_field = "companyName"
+    global_reference_tables = ["Currencies", "Subsidiaries", "VendorCategory"]
+    record_extra_pk_mappings = VendorSchemaMapper.record_extra_pk_mappings
 
     def get_batch_reference_data(self, context) -> dict:
         raw_records = context["records"]
 
+        if self.can_skip_existence_lookup(raw_records, "vendorNumber"):
+            # every vendor is upserted by externalId
+            return {
+                **self._target.reference_data,
+                self.name: [],
+                "Addresses": {}
+            }
+
         ids = {record["id"] for record in raw_records if record.get("id")}
         entity_ids = {record["vendorNumber"] for record in raw_records if record.get("vendorNumber")}
         external_ids = {record["externalId"] for record in raw_records if record.get("externalId")}
@@ -1,7 +1,11 @@
 import abc
 import json
 import hashlib
+import heapq
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from singer_sdk.plugin_base import PluginBase
 from singer_sdk.sinks import BatchSink
@@ -9,6 +13,8 @@ from target_hotglue.client import HotglueBaseSink
 from target_hotglue.common import HGJSONEncoder
 from typing import Dict, List, Optional
 from target_netsuite_v2.suite_talk_client import SuiteTalkRestClient
+from target_netsuite_v2.batch_controller import BatchSizeController
+from target_netsuite_v2.reference_data import ReferenceData
 from target_netsuite_v2.mapper.base_mapper import extract_addresses_from_record, InvalidInputError, InvalidDateError, DATE_REGEX
 
 class NetSuiteBaseSink(HotglueBaseSink):
@@ -21,6 +27,16 @@ class NetSuiteBaseSink(HotglueBaseSink):
     ) -> None:
         super().__init__(target, stream_name, schema, key_properties)
         self.suite_talk_client: SuiteTalkRestClient = self._target.suite_talk_client
+        self._state_lock = threading.RLock()
+        self._reference_data_lock = threading.RLock()
+        self._indexed_states = None
+        self._indexed_states_count = 0
+        self._states_by_hash = {}
+
+    @property
+    def max_concurrency(self) -> int:
+        """Number of records upserted in parallel, defaults to 1 (serial)"""
+        return max(int(self.config.get("max_concurrency") or 1), 1)
 
     def record_exists(self, record: dict) -> bool:
         return bool(record.get("internalId"))
@@ -29,16 +45,114 @@ class NetSuiteBaseSink(HotglueBaseSink):
         return hashlib.sha256(json.dumps(record, cls=HGJSONEncoder).encode()).hexdigest()
 
     def get_existing_state(self, hash: str):
-        states = self.latest_state["bookmarks"][self.name]
-
-        existing_state = next((s for s in states if hash==s.get("hash") and s.get("success")), None)
+        with self._state_lock:
+            existing_state = self._successful_states_by_hash().get(hash)
 
         if existing_state:
-            self.latest_state["summary"][self.name]["existing"] += 1
+            self._count_existing()
 
         return existing_state
 
+    def _successful_states_by_hash(self) -> dict:
+        """Index of the successful bookmark states by record hash
+
+        It is built once from the states loaded at startup and then extended with
+        the states `update_state` appended since the last lookup.
+        """
+        states = self.latest_state["bookmarks"][self.name]
+        if self._indexed_states is not states:
+            self._indexed_states = states
+            self._indexed_states_count = 0
+            self._states_by_hash = {}
+
+        for state in states[self._indexed_states_count:]:
+            hash = state.get("hash")
+            if hash and state.get("success"):
+                self._states_by_hash.setdefault(hash, state)
+        self._indexed_states_count = len(states)
+
+        return self._states_by_hash
+
+    def _count_existing(self):
+        with self._state_lock:
+            self.latest_state["summary"][self.name]["existing"] += 1
+
 class NetSuiteBatchSink(NetSuiteBaseSink, BatchSink):
+    # Global reference tables read by the sink mappers, prefetched when the stream starts
+    global_reference_tables = []
+    # Streams whose records the sink references (e.g. Bills reference Vendors), they are drained before this one
+    upstream_streams = []
+    # Record type of the entities written by the sink, cached for the lookups of other streams
+    entity_cache_record_type = None
+    # Payload field holding the record name, created records are added by name to the batch reference data and the entity cache
+    entity_name_field = None
+    # Set on sinks whose write is a single create or update of the mapped payload, these can be written as async jobs
+    bulk_write_capable = False
+    # SOAP record type of the sinks whose payloads can be written with the SOAP list operations
+    soap_record_type = None
+    # Cleared on sinks that only create records, bulk writes then reject the records that already exist
+    updates_existing_records = True
+    # Raw fields referencing another record of the stream (e.g. a parent customer) mapped to the field of the
+    # referenced record they match, a record is written after the record of its batch it references
+    parent_reference_fields = {}
+    # Raw fields the mapper matches existing records by besides the id and externalId (its `record_extra_pk_mappings`)
+    record_extra_pk_mappings = []
+
+    @property
+    def write_engine(self) -> str:
+        """How records are written: `rest` (a request per record), `rest_upsert` (new records are upserted by
+        externalId), `rest_async` (NetSuite async jobs) or `soap_bulk` (SOAP list operations)
+
+        `write_engines` maps stream names to the engine of that stream, `write_engine` is the default.
+        """
+        return (self.config.get("write_engines") or {}).get(self.name) or self.config.get("write_engine") or "rest"
+
+    def can_skip_existence_lookup(self, records: list, *key_fields) -> bool:
+        """Whether the lookup of the existing records of a batch can be skipped
+
+        In `rest_upsert` mode a record keyed by externalId only is upserted without knowing if it
+        exists. Records holding one of the other `key_fields` the mapper matches existing records
+        by (e.g. id or the entity number), or addresses, which are compared with the addresses
+        of the existing record, still need the lookup.
+        """
+        return self.write_engine == "rest_upsert" and all(
+            record.get("externalId") and
+            not record.get("addresses") and
+            not any(record.get(field) for field in ("id", *key_fields))
+            for record in records
+        )
+
+    @property
+    def batch_controller(self) -> Optional[BatchSizeController]:
+        """Picks the size of the next batch when `adaptive_batch_size` is set, within `batch_size_min` and `batch_size_max`"""
+        if not self.config.get("adaptive_batch_size"):
+            return None
+        if getattr(self, "_batch_controller", None) is None:
+            self._batch_controller = BatchSizeController(
+                min_size=int(self.config.get("batch_size_min") or 10),
+                max_size=int(self.config.get("batch_size_max") or super().max_size),
+                initial_size=int(self.config.get("batch_size_initial") or 100),
+                target_latency=float(self.config.get("batch_target_latency") or 60.0),
+                max_bytes=self.config.get("batch_max_bytes"),
+                max_error_rate=float(self.config.get("batch_max_error_rate") or 0.2)
+            )
+        return self._batch_controller
+
+    @property
+    def max_size(self) -> int:
+        if self.batch_controller is None:
+            return super().max_size
+        return self.batch_controller.size
+
+    @property
+    def bulk_writer(self):
+        """The function writing a round of preprocessed records with the configured engine, None for `rest`"""
+        if self.write_engine == "rest_async" and self.bulk_write_capable:
+            return self.write_records_async
+        if self.write_engine == "soap_bulk" and self.soap_record_type:
+            return self.write_records_soap
+        return None
+
     def process_batch(self, context: dict) -> None:
         """Process a batch with the given batch context.
 
@@ -55,10 +169,388 @@ class NetSuiteBatchSink(NetSuiteBaseSink, BatchSink):
         if not batch_records:
             return
 
-        reference_data = self.get_batch_reference_data(context)
+        states_count = len(self.latest_state["bookmarks"][self.name])
+        started = time.monotonic()
+        if self.pipeline_chunk_size and len(batch_records) > self.pipeline_chunk_size:
+            lookup_seconds = self.process_batch_pipelined(context, batch_records)
+        else:
+            reference_data = ReferenceData(self.get_batch_reference_data(context), parent=self._target.reference_data)
+            lookup_seconds = time.monotonic() - started
+            self.write_batch_records(batch_records, reference_data)
+
+        if self.batch_controller is not None:
+            self.observe_batch(batch_records, lookup_seconds, time.monotonic() - started - lookup_seconds, states_count)
+
+    def write_batch_records(self, batch_records: list, reference_data: dict):
+        if self.bulk_writer:
+            self.process_batch_records_in_rounds(batch_records, reference_data, self.bulk_writer)
+        elif self.max_concurrency > 1:
+            self.process_batch_records_concurrently(batch_records, reference_data)
+        else:
+            for record in batch_records:
+                self.process_batch_record(record, reference_data)
+
+    @property
+    def pipeline_chunk_size(self) -> int:
+        """Records per chunk of a pipelined batch (`pipeline_chunk_size`), 0 disables pipelining"""
+        return int(self.config.get("pipeline_chunk_size") or 0)
+
+    def process_batch_pipelined(self, context: dict, batch_records: list) -> float:
+        """Process a batch in chunks, the reference data of a chunk is fetched while the previous chunk is written
+
+        The records of a group (see `_group_records`) are kept in the same chunk. The lookups
+        of a chunk run before the previous chunks are written, so the rows they created are
+        merged into its reference data (like they are appended to the reference data of the batch
+        that created them). Returns the time spent waiting for lookups.
+        """
+        chunks = self._pipeline_chunks(batch_records)
+        lookup_seconds = 0.0
+        created_rows = {}
+        created_addresses = {}
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            lookup = executor.submit(self._chunk_reference_data, context, chunks[0])
+            for position, chunk in enumerate(chunks):
+                waiting_started = time.monotonic()
+                reference_data = lookup.result()
+                lookup_seconds += time.monotonic() - waiting_started
+                if position + 1 < len(chunks):
+                    lookup = executor.submit(self._chunk_reference_data, context, chunks[position + 1])
+
+                rows = reference_data.get(self.name)
+                addresses = reference_data.get("Addresses")
+                self._merge_created_rows(rows, addresses, created_rows, created_addresses)
+                rows_count = len(rows) if rows is not None else 0
+
+                self.write_batch_records(chunk, reference_data)
+
+                if rows is not None:
+                    for row in rows[rows_count:]:
+                        created_rows.setdefault(str(row["internalId"]), row)
+                        if isinstance(addresses, dict) and row["internalId"] in addresses:
+                            created_addresses[row["internalId"]] = addresses[row["internalId"]]
+
+        return lookup_seconds
+
+    def _chunk_reference_data(self, context: dict, chunk: list) -> ReferenceData:
+        return ReferenceData(self.get_batch_reference_data({**context, "records": chunk}), parent=self._target.reference_data)
+
+    def _pipeline_chunks(self, batch_records: list) -> list:
+        chunks = []
+        chunk = []
+        for group in self._group_records(batch_records):
+            if chunk and len(chunk) + len(group) > self.pipeline_chunk_size:
+                chunks.append(chunk)
+                chunk = []
+            chunk.extend(record for _, record in group)
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    @staticmethod
+    def _merge_created_rows(rows, addresses, created_rows: dict, created_addresses: dict):
+        """Adds the rows created by the previous chunks that the lookups of a chunk didn't return"""
+        if rows is None or not created_rows:
+            return
+        # tables shared with the global reference data (e.g. Accounts) already hold the created rows
+        present = {str(row.get("internalId")) for row in rows}
+        rows.extend(row for internal_id, row in created_rows.items() if internal_id not in present)
+        if isinstance(addresses, dict):
+            for internal_id, entity_addresses in created_addresses.items():
+                addresses.setdefault(internal_id, entity_addresses)
+
+    def observe_batch(self, batch_records: list, lookup_seconds: float, write_seconds: float, states_count: int):
+        """Reports the cost of a drained batch to the batch controller, which sizes the next batch"""
+        payload_bytes = len(json.dumps(batch_records, cls=HGJSONEncoder))
+        errors = sum(1 for state in self.latest_state["bookmarks"][self.name][states_count:] if not state.get("success"))
+        size = self.batch_controller.observe(len(batch_records), lookup_seconds, write_seconds, payload_bytes, errors)
+        self.logger.info(
+            f"{self.name} batch of {len(batch_records)} records: lookups {lookup_seconds:.1f}s, writes {write_seconds:.1f}s, "
+            f"{payload_bytes} bytes, {errors} errors, next batch size {size}"
+        )
+
+    def process_batch_records_concurrently(self, batch_records: list, reference_data: dict):
+        """Upsert the records of a batch on a bounded worker pool
+
+        Records sharing an id, externalId or payload hash, and the records referencing another
+        record of the batch (see `_group_records`), are grouped and processed in order by a single
+        worker, so a record created earlier in the batch is found by the ones after it.
+        State updates are applied in the original batch order once all groups are done.
+
+        Args:
+            batch_records: The raw records in the batch.
+            reference_data: A dictionary containing all reference_data necessary for a batch.
+        """
+        results = [None] * len(batch_records)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [
+                executor.submit(self._process_record_group, group, reference_data)
+                for group in self._group_records(batch_records)
+            ]
+            for future in futures:
+                for index, result in future.result():
+                    results[index] = result
+
+        for state, update_kwargs in results:
+            self.update_state(state, **update_kwargs)
+
+    def process_batch_records_in_rounds(self, batch_records: list, reference_data: dict, write_records):
+        """Upsert the records of a batch with a bulk write engine
+
+        Records are written in rounds holding at most one record per group (see `_group_records`),
+        so a record is mapped and written after the ones sharing its key and the ones it references
+        (e.g. it finds the record created by an earlier round). The records of a round are written at once
+        by `write_records`. State updates are applied in the original batch order once all
+        rounds are done.
+
+        Args:
+            batch_records: The raw records in the batch.
+            reference_data: A dictionary containing all reference_data necessary for a batch.
+            write_records: Writes a list of preprocessed records, returns a `(id, success, error_message)` tuple per record.
+        """
+        rounds = []
+        for group in self._group_records(batch_records):
+            for position, (index, record) in enumerate(group):
+                if position == len(rounds):
+                    rounds.append([])
+                rounds[position].append((index, record))
+
+        results = [None] * len(batch_records)
+        # states of records already written in an earlier round, their state is not in the bookmarks yet
+        written_states = {}
+        for round_records in rounds:
+            writes = []
+            for index, record in round_records:
+                hash = self.build_record_hash(record)
+                if hash in written_states:
+                    self._count_existing()
+                    results[index] = (written_states[hash], {"is_duplicate": True, "record": record})
+                    continue
+
+                preprocessed, result = self.prepare_batch_record(record, reference_data)
+                if result is not None:
+                    results[index] = result
+                elif self.record_exists(preprocessed) and not self.updates_existing_records:
+                    results[index] = self.complete_batch_record_state(record, preprocessed, None, False, {"error": "Record already exists"})
+                else:
+                    writes.append((index, record, hash, preprocessed))
+
+            write_results = write_records([preprocessed for _, _, _, preprocessed in writes])
+
+            for (index, record, hash, preprocessed), (id, success, error_message) in zip(writes, write_results):
+                state = self.apply_write_result(preprocessed, reference_data, id, error_message, did_update=self.record_exists(preprocessed))
+                state, update_kwargs = self.complete_batch_record_state(record, preprocessed, id, success, state)
+                if state.get("success"):
+                    written_states[hash] = state
+                results[index] = (state, update_kwargs)
+
+        for state, update_kwargs in results:
+            self.update_state(state, **update_kwargs)
+
+    def write_records_async(self, records: list) -> list:
+        return self.suite_talk_client.write_records_async([
+            (self.record_type, record["internalId"] if self.record_exists(record) else None, record)
+            for record in records
+        ])
+
+    def write_records_soap(self, records: list) -> list:
+        """Writes the records with the SOAP list operations, the ones SOAP can't express are written over REST
+
+        Sinks that don't update existing records only add new ones, they are never upserted.
+        """
+        results = self.suite_talk_client.write_records_soap([
+            (self.soap_record_type, record["internalId"] if self.record_exists(record) else None, record)
+            for record in records
+        ], upsert=self.updates_existing_records)
+        for position, (record, result) in enumerate(zip(records, results)):
+            if result is not None:
+                continue
+            if self.record_exists(record):
+                results[position] = self.suite_talk_client.update_record(self.record_type, record["internalId"], record)
+            else:
+                results[position] = self.suite_talk_client.create_record(self.record_type, record)
+        return results
+
+    def create_records_concurrently(self, record_type: str, records: list) -> list:
+        """Creates records at once (e.g. the payments of a bill), returns a `(id, success, error_message)` tuple per record in order
+
+        The requests still go through the client's governor, so they stay within the account concurrency limit.
+        """
+        if len(records) <= 1:
+            return [self.suite_talk_client.create_record(record_type, record) for record in records]
+
+        max_workers = min(len(records), self.suite_talk_client.governor.concurrency_limit)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda record: self.suite_talk_client.create_record(record_type, record), records))
+
+    def _group_records(self, batch_records: list) -> list:
+        """Groups the records of a batch that have to be written one after the other
+
+        Records sharing an id, externalId, payload hash or one of the mapper's extra primary keys
+        (`record_extra_pk_mappings`, e.g. an invoiceNumber) are grouped in batch order, so the
+        later ones find the record created by the first. A record referencing another record of
+        the batch through `parent_reference_fields` (e.g. a customer whose parentNumber is the
+        customerNumber of another one) joins the group of that record and comes after it.
+        Returns lists of `(index, record)` tuples.
+        """
+        record_keys = [
+            [
+                self._record_group_key(record),
+                *(
+                    ("extra_pk", mapping["record_field"], str(record[mapping["record_field"]]))
+                    for mapping in self.record_extra_pk_mappings
+                    if record.get(mapping["record_field"])
+                )
+            ]
+            for record in batch_records
+        ]
+        roots = list(range(len(batch_records)))
+
+        def root_of(index):
+            while roots[index] != index:
+                roots[index] = roots[roots[index]]
+                index = roots[index]
+            return index
+
+        def union(index, other):
+            roots[root_of(index)] = root_of(other)
+
+        # a record comes after the previous record sharing one of its keys and after the records it references
+        predecessors = [set() for _ in batch_records]
+        previous_by_key = {}
+        for index, keys in enumerate(record_keys):
+            for key in keys:
+                if key in previous_by_key:
+                    predecessors[index].add(previous_by_key[key])
+                    union(index, previous_by_key[key])
+                previous_by_key[key] = index
+
+        if self.parent_reference_fields:
+            records_by_value = {}
+            for index, record in enumerate(batch_records):
+                for field in set(self.parent_reference_fields.values()):
+                    if record.get(field):
+                        records_by_value.setdefault((field, str(record[field])), []).append(index)
+
+            for index, record in enumerate(batch_records):
+                for reference_field, field in self.parent_reference_fields.items():
+                    if not record.get(reference_field):
+                        continue
+                    for parent in records_by_value.get((field, str(record[reference_field])), ()):
+                        if parent != index:
+                            predecessors[index].add(parent)
+                            union(index, parent)
+
+        groups = {}
+        for index in self._dependency_order(predecessors):
+            groups.setdefault(root_of(index), []).append((index, batch_records[index]))
+        return list(groups.values())
+
+    @staticmethod
+    def _dependency_order(predecessors: list) -> list:
+        """Orders indexes after their predecessors, ties and reference cycles are kept in batch order"""
+        dependents = [[] for _ in predecessors]
+        waiting = [len(preceding) for preceding in predecessors]
+        for index, preceding in enumerate(predecessors):
+            for predecessor in preceding:
+                dependents[predecessor].append(index)
+
+        ready = [index for index, count in enumerate(waiting) if count == 0]
+        heapq.heapify(ready)
+        placed = [False] * len(predecessors)
+        order = []
+        while len(order) < len(predecessors):
+            if ready:
+                index = heapq.heappop(ready)
+            else:
+                index = next(index for index, is_placed in enumerate(placed) if not is_placed)
+            placed[index] = True
+            order.append(index)
+            for dependent in dependents[index]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0 and not placed[dependent]:
+                    heapq.heappush(ready, dependent)
+        return order
+
+    def _record_group_key(self, record: dict) -> tuple:
+        if record.get("id"):
+            return ("id", str(record["id"]))
+        if record.get("externalId"):
+            return ("externalId", record["externalId"])
+        return ("hash", self.build_record_hash(record))
+
+    def _process_record_group(self, group: list, reference_data: dict) -> list:
+        results = []
+        # states of records already written by this group, their state is not in the bookmarks yet
+        written_states = {}
+        for index, record in group:
+            hash = self.build_record_hash(record)
+            if hash in written_states:
+                self._count_existing()
+                results.append((index, (written_states[hash], {"is_duplicate": True, "record": record})))
+                continue
+
+            state, update_kwargs = self.build_batch_record_state(record, reference_data)
+            if state.get("success"):
+                written_states[hash] = state
+            results.append((index, (state, update_kwargs)))
+
+        return results
+
+    def get_cached_reference_data(self, record_type: str, **filters):
+        """Calls `get_reference_data` through the target entity cache
+
+        Only the keys that were not found in earlier batches are queried from NetSuite.
+        """
+        entity_cache = self._target.entity_cache
+
+        rows = []
+        missing_filters = {}
+        for argument, values in filters.items():
+            dimension = entity_cache.dimensions[argument]
+            missing_values = set()
+            for value in values or []:
+                cached_rows = entity_cache.get(record_type, dimension, value)
+                if cached_rows is None:
+                    missing_values.add(value)
+                else:
+                    rows.extend(cached_rows)
+            if missing_values:
+                missing_filters[argument] = missing_values
+
+        success, error_message = True, None
+        if missing_filters:
+            success, error_message, fetched_rows = self.suite_talk_client.get_reference_data(record_type, **missing_filters)
+            if success:
+                entity_cache.put(record_type, fetched_rows, names=missing_filters.get("names"))
+                rows.extend(fetched_rows)
+
+        unique_rows = {}
+        for row in rows:
+            unique_rows.setdefault(str(row["internalId"]), row)
+
+        return success, error_message, list(unique_rows.values())
+
+    def run_concurrent_lookups(self, **lookups) -> dict:
+        """Runs independent lookups at the same time and returns their rows by name
+
+        Each lookup is a callable returning `(success, error_message, rows)`. The requests
+        they make still go through the client governor.
+        """
+        with ThreadPoolExecutor(max_workers=max(len(lookups), 1)) as executor:
+            futures = {name: executor.submit(lookup) for name, lookup in lookups.items()}
+            return {name: future.result()[2] for name, future in futures.items()}
 
-        for record in batch_records:
-            self.process_batch_record(record, reference_data)
+    def cache_written_entity(self, id, record: dict, created: bool):
+        if not self.entity_cache_record_type:
+            return
+        if not created:
+            # the update may have changed any of the cached keys
+            self._target.entity_cache.invalidate(self.entity_cache_record_type, id)
+            return
+        row = {"internalId": id, "externalId": record.get("externalId"), "entityId": record.get("entityId"), "itemId": record.get("itemId")}
+        if self.entity_name_field and record.get(self.entity_name_field):
+            row["name"] = record[self.entity_name_field]
+        self._target.entity_cache.add(self.entity_cache_record_type, row)
 
     def get_batch_reference_data(self, context: dict) -> dict:
         """Get the reference data for a batch
@@ -81,6 +573,33 @@ class NetSuiteBatchSink(NetSuiteBaseSink, BatchSink):
             record: Individual raw record in the stream.
             reference_data: A dictionary containing all reference_data necessary for a batch.
         """
+        state, update_kwargs = self.build_batch_record_state(record, reference_data)
+        self.update_state(state, **update_kwargs)
+
+    def build_batch_record_state(self, record: dict, reference_data: dict):
+        """Preprocess and upsert a record without updating the state
+
+        Args:
+            record: Individual raw record in the stream.
+            reference_data: A dictionary containing all reference_data necessary for a batch.
+
+        Returns:
+            A tuple with the state and the keyword arguments for `update_state`.
+        """
+        preprocessed, result = self.prepare_batch_record(record, reference_data)
+        if result is not None:
+            return result
+
+        id, success, state = self.upsert_record(preprocessed, reference_data)
+        return self.complete_batch_record_state(record, preprocessed, id, success, state)
+
+    def prepare_batch_record(self, record: dict, reference_data: dict):
+        """Preprocess a record that may have to be written
+
+        Returns:
+            A tuple with the preprocessed record and None, or None and the `(state, update_kwargs)`
+            of a record that isn't written (invalid input or already written in an earlier run).
+        """
         hash = self.build_record_hash(record)
         existing_state = self.get_existing_state(hash)
         try:
@@ -95,16 +614,16 @@ class NetSuiteBatchSink(NetSuiteBaseSink, BatchSink):
             id = record.get("id")
             if id:
                 state["id"] = id
-            self.update_state(state)
-            return
-
-        external_id = preprocessed.get("externalId")
+            return None, (state, {})
 
         if existing_state:
-            self.update_state(existing_state, is_duplicate=True, record=record)
-            return
+            return None, (existing_state, {"is_duplicate": True, "record": record})
 
-        id, success, state = self.upsert_record(preprocessed, reference_data)
+        return preprocessed, None
+
+    def complete_batch_record_state(self, record: dict, preprocessed: dict, id, success: bool, state: dict):
+        """Completes the state of a written record, returns it with the keyword arguments for `update_state`"""
+        external_id = preprocessed.get("externalId")
 
         if success:
             self.logger.info(f"{self.name} processed id: {id}")
@@ -117,7 +636,7 @@ class NetSuiteBatchSink(NetSuiteBaseSink, BatchSink):
         if external_id:
             state["externalId"] = external_id
 
-        self.update_state(state, record=record)
+        return state, {"record": record}
 
     @abc.abstractmethod
     def preprocess_batch_record(self, record: dict) -> dict:
@@ -132,25 +651,50 @@ class NetSuiteBatchSink(NetSuiteBaseSink, BatchSink):
         pass
 
     def upsert_record(self, record: dict, reference_data: dict):
-        state = {}
-
         did_update = False
+        upserted = False
         if self.record_exists(record):
             id, success, error_message = self.suite_talk_client.update_record(self.record_type, record['internalId'], record)
             did_update = True
+        elif self.write_engine == "rest_upsert" and record.get("externalId"):
+            id, success, error_message = self.suite_talk_client.upsert_record(self.record_type, record["externalId"], record)
+            upserted = True
         else:
             id, success, error_message = self.suite_talk_client.create_record(self.record_type, record)
-            if not error_message:
-                reference_data.get(self.name, []).append({"internalId": id, "externalId": record.get("externalId"), "entityId": record.get("entityId"), "tranId": record.get("tranId"), "itemId": record.get("itemId")})
+
+        state = self.apply_write_result(record, reference_data, id, error_message, did_update, upserted)
+
+        return id, success, state
+
+    def apply_write_result(self, record: dict, reference_data: dict, id, error_message, did_update: bool, upserted: bool = False) -> dict:
+        """Records a create or update in the batch reference data and the entity cache, returns the record state
+
+        NetSuite answers an upsert by externalId the same way whether it created or updated the
+        record, so an `upserted` record is added to the batch reference data but only dropped from
+        the entity cache, which may hold the previous version of an updated record.
+        """
+        state = {}
+
+        if not did_update and not error_message:
+            with self._reference_data_lock:
+                row = {"internalId": id, "externalId": record.get("externalId"), "entityId": record.get("entityId"), "tranId": record.get("tranId"), "itemId": record.get("itemId")}
+                if self.entity_name_field and record.get(self.entity_name_field):
+                    # the name the later records of the batch reference it by (e.g. a parentName)
+                    row["name"] = record[self.entity_name_field]
+                reference_data.get(self.name, []).append(row)
                 if addresses := extract_addresses_from_record(record):
                     reference_data.get("Addresses", {})[id] = addresses
 
         if error_message:
             state["error"] = error_message
-        elif did_update:
-            state["is_updated"] = True
+        elif upserted:
+            self.cache_written_entity(id, record, created=False)
+        else:
+            self.cache_written_entity(id, record, created=not did_update)
+            if did_update:
+                state["is_updated"] = True
 
-        return id, success, state
+        return state
 
     def _are_dates_equivalent(self, netsuite_date, unified_date) -> bool:
         """Compares two date strings and returns True if they have the same month, day, and year."""
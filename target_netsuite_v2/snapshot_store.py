@@ -0,0 +1,120 @@
+import json
+import os
+import sqlite3
+
+from collections.abc import Mapping
+from contextlib import closing
+from typing import Iterator
+
+
+class SnapshotStore(Mapping):
+    """Reference data snapshot stored in a SQLite file
+
+    Every table is a section of the `rows` table holding one JSON encoded row per record, with
+    its internalId, externalId and name in indexed columns. `find` reads the rows matching a
+    key through those indexes and `iter_rows` decodes a table row by row, so neither
+    deserializes a whole table. It behaves like the dict loaded from the JSON snapshot:
+    metadata keys (write_date, watermarks, ...) and table names map to their values, and
+    tables are loaded on first access.
+    """
+
+    # row field -> indexed column
+    key_columns = {"internalId": "internal_id", "externalId": "external_id", "name": "name"}
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._tables = {}
+        self._meta = {}
+        self._section_names = set()
+        if os.path.exists(path):
+            self._read_meta()
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per operation, tables are loaded from several threads
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("CREATE TABLE IF NOT EXISTS row_sections (name TEXT PRIMARY KEY, row_count INTEGER)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            "section TEXT, position INTEGER, internal_id TEXT, external_id TEXT, name TEXT, data TEXT, "
+            "PRIMARY KEY (section, position))"
+        )
+        for column in self.key_columns.values():
+            connection.execute(f"CREATE INDEX IF NOT EXISTS rows_{column} ON rows (section, {column})")
+        return connection
+
+    def _read_meta(self) -> None:
+        with closing(self._connect()) as connection:
+            self._meta = {key: json.loads(value) for key, value in connection.execute("SELECT key, value FROM meta")}
+            # snapshots written with one compressed blob per table have no row sections, their tables are fetched again
+            self._section_names = {name for (name,) in connection.execute("SELECT name FROM row_sections")}
+
+    def __getitem__(self, key):
+        if key in self._meta:
+            return self._meta[key]
+        if key not in self._section_names:
+            raise KeyError(key)
+        if key not in self._tables:
+            self._tables[key] = list(self.iter_rows(key))
+        return self._tables[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._meta or key in self._section_names
+
+    def __iter__(self):
+        yield from self._meta
+        yield from self._section_names
+
+    def __len__(self) -> int:
+        return len(self._meta) + len(self._section_names)
+
+    def iter_rows(self, name: str) -> Iterator[dict]:
+        """Yields the rows of a table in order, decoding them as they are read"""
+        if name in self._tables:
+            yield from self._tables[name]
+            return
+        if name not in self._section_names:
+            raise KeyError(name)
+        with closing(self._connect()) as connection:
+            for (data,) in connection.execute("SELECT data FROM rows WHERE section = ? ORDER BY position", (name,)):
+                yield json.loads(data)
+
+    def find(self, name: str, field: str, value) -> list:
+        """Returns the rows of a table whose `field` (internalId, externalId or name) equals `value`"""
+        column = self.key_columns[field]
+        if name not in self._section_names or value is None:
+            return []
+        with closing(self._connect()) as connection:
+            return [
+                json.loads(data)
+                for (data,) in connection.execute(
+                    f"SELECT data FROM rows WHERE section = ? AND {column} = ? ORDER BY position", (name, str(value))
+                )
+            ]
+
+    def write(self, tables: dict, meta: dict) -> None:
+        """Replaces the sections of the given tables and the metadata, other sections are kept as is"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            for name, rows in tables.items():
+                connection.execute("DELETE FROM rows WHERE section = ?", (name,))
+                connection.executemany(
+                    "INSERT INTO rows (section, position, internal_id, external_id, name, data) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        (name, position, *(self._key(row.get(field)) for field in self.key_columns), json.dumps(dict(row)))
+                        for position, row in enumerate(rows)
+                    )
+                )
+                connection.execute("INSERT OR REPLACE INTO row_sections (name, row_count) VALUES (?, ?)", (name, len(rows)))
+            for key, value in meta.items():
+                connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            # the sections of the previous format are replaced by the row sections
+            connection.execute("DROP TABLE IF EXISTS sections")
+
+        self._tables.update(tables)
+        self._section_names.update(tables)
+        self._meta.update(meta)
+
+    @staticmethod
+    def _key(value):
+        return None if value is None else str(value)
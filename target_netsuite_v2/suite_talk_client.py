@@ -1,11 +1,21 @@
 import json
+import time
 import requests
+from urllib.parse import quote
 from typing import List, Dict, Optional, Set
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 from oauthlib import oauth1
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth1
 from target_hotglue.common import HGJSONEncoder
+from target_netsuite_v2.governor import RequestGovernor
+from target_netsuite_v2.query_cache import QueryCache
+from target_netsuite_v2.reference_data import ReferenceRow
+from target_netsuite_v2.suiteql_decoder import SuiteQLPageDecoder
+from target_netsuite_v2.suite_talk_soap_client import SuiteTalkSoapClient
 
 class SuiteTalkRestClient:
     ref_select_clauses = {
@@ -38,13 +48,164 @@ class SuiteTalkRestClient:
         "item": "item.fullName"
     }
 
+    # Tables whose rows can be refreshed incrementally, these expose a last modified date in SuiteQL
+    ref_last_modified_fields = {
+        "account": "account.lastmodifieddate",
+        "classification": "classification.lastmodifieddate",
+        "customer": "customer.lastmodifieddate",
+        "department": "department.lastmodifieddate",
+        "employee": "employee.lastmodifieddate",
+        "item": "item.lastmodifieddate",
+        "location": "location.lastmodifieddate",
+        "subsidiary": "subsidiary.lastmodifieddate",
+        "vendor": "vendor.lastmodifieddate"
+    }
+
     ref_join_clauses = {
         "salestaxitem": "inner join customrecord_ste_taxrate on customrecord_ste_taxrate.custrecord_ste_taxrate_taxcode = salestaxitem.id"
     }
 
+    # Transaction line columns read by the sinks, lines are grouped by transaction and compared by memo and type
+    transaction_line_columns = "t.recordtype, tl.transaction, tl.id, tl.memo, tl.accountinglinetype"
+
+    # Address columns compared with the unified addresses (see BaseMapper._check_for_existing_address)
+    address_columns = ("addrtext", "addr1", "addr2", "addr3", "city", "state", "country", "zip")
+
+    # SuiteQL response fields come in as lower case,
+    # even when using `AS` syntax that includes capital letters
+    transaction_field_names = {
+        "internalid": "internalId",
+        "externalid": "externalId",
+        "subsidiaryid": "subsidiaryId",
+        "tranid": "tranId"
+    }
+
+    ref_field_names = {
+        "internalid": "internalId",
+        "externalid": "externalId",
+        "subsidiaryid": "subsidiaryId",
+        "entityid": "entityId",
+        "itemid": "itemId",
+        "taxtype": "taxType",
+        "taxrate": "taxRate",
+        "lastmodified": "lastModified"
+    }
+
+    payment_field_names = {
+        "internalid": "internalId",
+        "externalid": "externalId",
+        "tranid": "tranId"
+    }
+
+    default_pool_maxsize = 16
+    default_connect_timeout = 10
+    default_read_timeout = 300
+    # NetSuite's base concurrency limit, accounts with SuiteCloud Plus licenses allow more
+    default_concurrency_limit = 5
+    default_max_retries = 5
+    # async jobs are polled every `async_poll_interval` seconds, doubling up to `async_poll_max_interval`
+    default_async_poll_interval = 1.0
+    default_async_poll_max_interval = 30.0
+    default_async_job_timeout = 3600.0
+    stream_chunk_size = 64 * 1024
+    # SuiteQL rejects IN lists over 1000 values and statements over its length limit
+    max_in_list_size = 1000
+    default_max_query_length = 50000
+    # keeps a line or payment lookup without key filters (e.g. get_invoice_items(None)) from reading every line of the account,
+    # full table loads (get_reference_data with allow_empty_filters, get_reference_ids) aren't limited
+    default_max_rows_per_query = 100000
+    # room left for the line and payment lookups embedding a transaction id subquery
+    subquery_reserved_length = 1000
+    # payload fields of a written record that can be the key of a cached lookup
+    query_cache_key_fields = ("externalId", "tranId", "entityId", "itemId", "companyName")
+
     def __init__(self, config, logger):
         self.config = config
         self.logger = logger
+        self._oauth = None
+        self._session = None
+        self._soap_client = None
+        self.governor = RequestGovernor(
+            int(config.get("ns_concurrency_limit") or self.default_concurrency_limit),
+            backoff_base=float(config.get("retry_backoff_base", 1.0)),
+            backoff_max=float(config.get("retry_backoff_max", 60.0))
+        )
+        self.max_retries = int(config.get("max_retries", self.default_max_retries))
+        self.query_cache = None
+        if config.get("suiteql_cache_ttl"):
+            self.query_cache = QueryCache(
+                config["suiteql_cache_path"],
+                config["suiteql_cache_ttl"],
+                ttls=config.get("suiteql_cache_ttls")
+            )
+
+    @property
+    def session(self) -> requests.Session:
+        """A persistent session so connections to NetSuite are kept alive and reused across requests"""
+        if self._session is None:
+            pool_maxsize = int(self.config.get("pool_maxsize", self.default_pool_maxsize))
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=True)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.headers.update({"Connection": "keep-alive"})
+            self._session = session
+        return self._session
+
+    @property
+    def soap_client(self) -> SuiteTalkSoapClient:
+        """SOAP client for bulk writes, it shares the governor so SOAP requests count against the same limit"""
+        if self._soap_client is None:
+            self._soap_client = SuiteTalkSoapClient(self.config, self.logger, self.governor, self.max_retries)
+        return self._soap_client
+
+    @property
+    def oauth(self) -> OAuth1:
+        """A single OAuth1 signer, it signs every request with a fresh nonce and timestamp"""
+        if self._oauth is None:
+            ns_account = self.config["ns_account"].replace("-", "_").upper()
+            self._oauth = OAuth1(
+                client_key=self.config["ns_consumer_key"],
+                client_secret=self.config["ns_consumer_secret"],
+                resource_owner_key=self.config["ns_token_key"],
+                resource_owner_secret=self.config["ns_token_secret"],
+                realm=ns_account,
+                signature_method=oauth1.SIGNATURE_HMAC_SHA256,
+            )
+        return self._oauth
+
+    @property
+    def timeout(self) -> tuple:
+        return (
+            float(self.config.get("connect_timeout", self.default_connect_timeout)),
+            float(self.config.get("request_timeout", self.default_read_timeout))
+        )
+
+    @property
+    def pool_stats(self) -> dict:
+        """Connection pool counters, a hit is a request served by an already open connection"""
+        stats = {"requests": 0, "connections": 0, "hits": 0, "misses": 0}
+        if self._session is None:
+            return stats
+
+        for adapter in self._session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+
+        stats["misses"] = stats["connections"]
+        stats["hits"] = max(stats["requests"] - stats["connections"], 0)
+        return stats
+
+    def close(self):
+        if self._session is not None:
+            self.logger.info(f"NetSuite connection pool stats: {self.pool_stats}")
+            self.logger.info(f"NetSuite request metrics: {self.governor.metrics}")
+            self._session.close()
+            self._session = None
 
     @property
     def url_account(self) -> str:
@@ -66,6 +227,7 @@ class SuiteTalkRestClient:
         url = f"{self.record_url}/{record_type}/{record_id}"
         response = self._make_request(url, "PATCH", data=record)
         success, error_message = self._validate_response(response)
+        self._invalidate_query_cache(record_id, record)
         return record_id, success, error_message
 
     def create_record(self, record_type, record):
@@ -73,8 +235,137 @@ class SuiteTalkRestClient:
         response = self._make_request(url, "POST", data=record)
         success, error_message = self._validate_response(response)
         record_id = self._extract_id_from_response_header(response.headers)
+        self._invalidate_query_cache(record_id, record)
         return record_id, success, error_message
 
+    def upsert_record(self, record_type, external_id, record):
+        """Creates or updates the record with the given externalId in a single request (`PUT eid:<externalId>`)"""
+        url = f"{self.record_url}/{record_type}/eid:{quote(str(external_id), safe='')}"
+        # the key is in the URL, NetSuite rejects upserts whose body holds it too
+        data = {key: value for key, value in record.items() if key not in ("internalId", "externalId")}
+        response = self._make_request(url, "PUT", data=data)
+        success, error_message = self._validate_response(response)
+        record_id = self._extract_id_from_response_header(response.headers)
+        self._invalidate_query_cache(record_id, record)
+        return record_id, success, error_message
+
+    def write_records_async(self, writes: List[tuple]) -> List[tuple]:
+        """Creates or updates records as NetSuite async jobs (`Prefer: respond-async`)
+
+        `writes` are `(record_type, record_id, record)` tuples, a record without id is created.
+        Every write is submitted at once, then the jobs are polled until they complete.
+        Returns a `(record_id, success, error_message)` tuple per write, in the order of `writes`.
+        """
+        if not writes:
+            return []
+
+        max_workers = max(min(self.governor.concurrency_limit, len(writes)), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            submissions = list(executor.map(lambda write: self._submit_async_write(*write), writes))
+
+        results = [None] * len(writes)
+        pending = {}
+        for index, (job_url, error_message) in enumerate(submissions):
+            if job_url:
+                pending[job_url] = index
+            else:
+                results[index] = (writes[index][1], False, error_message)
+
+        for job_url, (record_id, success, error_message) in self._wait_for_async_jobs(pending).items():
+            index = pending[job_url]
+            _, write_record_id, record = writes[index]
+            record_id = record_id or write_record_id
+            self._invalidate_query_cache(record_id, record)
+            results[index] = (record_id, success, error_message)
+
+        return results
+
+    def write_records_soap(self, writes: List[tuple], upsert: bool = True) -> List[Optional[tuple]]:
+        """Creates or updates records in bulk over SOAP
+
+        `writes` are `(soap_record_type, record_id, record)` tuples holding the REST payloads.
+        New records with an externalId are upserted unless `upsert` is off, they are then added.
+        Returns a `(record_id, success, error_message)` tuple per write, in the order of `writes`,
+        or None for the writes that can't be sent over SOAP and have to be written over REST.
+        """
+        if not writes:
+            return []
+
+        results = self.soap_client.write_records(writes, upsert=upsert)
+        for (_, _, record), result in zip(writes, results):
+            if result is not None:
+                self._invalidate_query_cache(result[0], record)
+        return results
+
+    def _submit_async_write(self, record_type, record_id, record):
+        if record_id:
+            url, method = f"{self.record_url}/{record_type}/{record_id}", "PATCH"
+        else:
+            url, method = f"{self.record_url}/{record_type}", "POST"
+
+        response = self._make_request(url, method, data=record, headers={"Prefer": "respond-async"})
+        success, error_message = self._validate_response(response)
+        if not success:
+            return None, error_message
+
+        job_url = response.headers.get("Location")
+        if not job_url:
+            return None, f"NetSuite didn't return an async job for {method} {record_type}"
+        return job_url, None
+
+    def _wait_for_async_jobs(self, job_urls) -> Dict[str, tuple]:
+        """Polls async jobs until they complete, all pending jobs are checked at every poll"""
+        poll_interval = float(self.config.get("async_poll_interval", self.default_async_poll_interval))
+        max_poll_interval = float(self.config.get("async_poll_max_interval", self.default_async_poll_max_interval))
+        deadline = time.monotonic() + float(self.config.get("async_job_timeout", self.default_async_job_timeout))
+
+        results = {}
+        pending = list(job_urls)
+        while pending:
+            time.sleep(poll_interval)
+            max_workers = max(min(self.governor.concurrency_limit, len(pending)), 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                polls = list(executor.map(self._poll_async_job, pending))
+
+            still_pending = []
+            for job_url, result in zip(pending, polls):
+                if result is None:
+                    still_pending.append(job_url)
+                else:
+                    results[job_url] = result
+            pending = still_pending
+
+            if pending and time.monotonic() > deadline:
+                for job_url in pending:
+                    results[job_url] = (None, False, f"Async job {job_url} didn't complete in time")
+                break
+            poll_interval = min(poll_interval * 2, max_poll_interval)
+
+        return results
+
+    def _poll_async_job(self, job_url):
+        """Returns the `(record_id, success, error_message)` of a completed job, None while it runs"""
+        response = self._make_request(job_url, "GET")
+        success, error_message = self._validate_response(response)
+        if not success:
+            return None, False, error_message
+        if not response.json().get("completed"):
+            return None
+
+        # the result of the task is the response the request would have had if sent synchronously
+        response = self._make_request(f"{job_url}/task", "GET")
+        success, error_message = self._validate_response(response)
+        if not success:
+            return None, False, error_message
+        tasks = response.json().get("items", [])
+        task_url = next((link["href"] for task in tasks for link in task.get("links", []) if link.get("rel") == "self"), None)
+        if not task_url:
+            return None, False, f"Async job {job_url} has no task"
+
+        response = self._make_request(f"{task_url}/result", "GET")
+        success, error_message = self._validate_response(response)
+        return self._extract_id_from_response_header(response.headers), success, error_message
+
     def create_item(self, item):
         url = self.get_item_url(item)
         if not url:
@@ -82,6 +373,7 @@ class SuiteTalkRestClient:
         response = self._make_request(url, "POST", data=item)
         success, error_message = self._validate_response(response)
         record_id = self._extract_id_from_response_header(response.headers)
+        self._invalidate_query_cache(record_id, item)
         return record_id, success, error_message
 
     def update_item(self, item_id, item):
@@ -92,6 +384,7 @@ class SuiteTalkRestClient:
         response = self._make_request(url, "PATCH", data=item)
         success, error_message = self._validate_response(response)
         record_id = self._extract_id_from_response_header(response.headers)
+        self._invalidate_query_cache(item_id, item)
         return record_id, success, error_message
 
     def get_item_url(self, item: dict) -> str:
@@ -154,72 +447,76 @@ class SuiteTalkRestClient:
         if extra_select_statement:
             extra_select_statement = f", {extra_select_statement}"
 
-        query = f"SELECT transaction.id as internalId, transaction.tranid as tranId, transaction.externalId as externalId, transaction.subsidiary as subsidiaryId{extra_select_statement} FROM transaction WHERE transaction.type = '{transaction_type}'"
-        where_clauses = []
+        query = f"SELECT transaction.id as internalId, transaction.tranid as tranId, transaction.externalId as externalId, transaction.subsidiary as subsidiaryId{extra_select_statement} FROM transaction"
+
+        lookups = {
+            "internalId": [str(self.safe_int_convert(id, 0)) for id in record_ids or []],
+            "tranId": list(tran_ids or []),
+            "externalId": list(external_ids or [])
+        }
+        cached_items = []
+        if self.query_cache is not None and any(lookups.values()):
+            cached_items, lookups = self._read_query_cache(transaction_type, query, lookups)
+            if not any(lookups.values()):
+                return True, None, self._unique_rows(cached_items)
+            record_ids, tran_ids, external_ids = lookups["internalId"], lookups["tranId"], lookups["externalId"]
+
+        filters = self._transaction_filters(external_ids, record_ids, tran_ids)
+
+        queries = self._plan_suiteql_queries(query, filters, [f"transaction.type = '{transaction_type}'"])
+        success, error_message, all_items = self._run_suiteql_queries(
+            queries, page_size, dedupe_key=self._internal_id_key, row_hook=self._row_hook(self.transaction_field_names),
+            max_rows=self._row_budget(filters)
+        )
+        if not success:
+            return success, error_message, []
+
+        if self.query_cache is not None and any(lookups.values()):
+            self._write_query_cache(transaction_type, query, lookups, all_items)
+            return True, None, self._unique_rows(cached_items + all_items)
+
+        return True, None, all_items
+
+    def get_transaction_id_queries(
+        self,
+        transaction_type,
+        external_ids: Optional[List[str]] = None,
+        record_ids: Optional[List[str]] = None,
+        tran_ids: Optional[List[str]] = None
+    ) -> List[str]:
+        """Returns SuiteQL queries selecting the ids of the transactions `get_transaction_data` would return
+
+        They are passed as `transaction_queries` to the line and payment lookups, which then
+        run alongside the transaction lookup instead of waiting for the ids it returns.
+        """
+        filters = self._transaction_filters(external_ids, record_ids, tran_ids)
+        if not filters:
+            return []
+
+        return self._plan_suiteql_queries(
+            "SELECT transaction.id FROM transaction",
+            filters,
+            [f"transaction.type = '{transaction_type}'"],
+            reserved_length=self.subquery_reserved_length
+        )
+
+    def _transaction_filters(self, external_ids, record_ids, tran_ids) -> List[tuple]:
+        filters = []
 
         if record_ids:
             # id has to be integer or the query will fail
             # so we convert to integer if possible, otherwise we use 0
             # this is a workaround for it not to break the query for
             # other ids or other filters
-            id_string = ",".join(str(self.safe_int_convert(id, 0)) for id in record_ids)
-            where_clauses.append(f"id IN ({id_string})")
+            filters.append(("id", [str(self.safe_int_convert(id, 0)) for id in record_ids]))
 
         if tran_ids:
-            tran_id_string = ",".join(f"'{id}'" for id in tran_ids)
-            where_clauses.append(f"tranId IN ({tran_id_string})")
+            filters.append(("tranId", [f"'{id}'" for id in tran_ids]))
 
         if external_ids:
-            external_ids_str = ",".join(f"'{id}'" for id in external_ids)
-            where_clauses.append(f"externalId IN ({external_ids_str})")
+            filters.append(("externalId", [f"'{id}'" for id in external_ids]))
 
-        if where_clauses:
-            where_statement = " OR ".join(where_clauses)
-            query += f" AND ({where_statement})"
-
-        all_items = []
-        offset = 0
-        limit = min(page_size, 1000)
-        has_more = True
-
-        while has_more:
-            query_data = {"q": query}
-            params = {"offset": offset, "limit": limit}
-            headers = {"Prefer": "transient"}
-
-            response = self._make_request(
-                url=self.suiteql_url,
-                method="POST",
-                data=query_data,
-                params=params,
-                headers=headers
-            )
-
-            success, error_message = self._validate_response(response)
-            if not success:
-                return success, error_message, []
-
-            resp_json = response.json()
-            items = resp_json.get("items", [])
-
-            # SuiteQL response fields come in as lower case,
-            # even when using `AS` syntax that includes capital letters
-            for item in items:
-                if "internalid" in item:
-                    item["internalId"] = item.pop("internalid")
-                if "externalid" in item:
-                    item["externalId"] = item.pop("externalid")
-                if "subsidiaryid" in item:
-                    item["subsidiaryId"] = item.pop("subsidiaryid")
-                if "tranid" in item:
-                    item["tranId"] = item.pop("tranid")
-
-            all_items.extend(items)
-
-            has_more = resp_json.get("hasMore", False)
-            offset += limit
-
-        return True, None, all_items
+        return filters
 
     def get_reference_data(
         self,
@@ -230,136 +527,101 @@ class SuiteTalkRestClient:
         entity_ids: Optional[List[str]] = None,
         item_ids: Optional[List[str]] = None,
         page_size=1000,
-        allow_empty_filters=False
+        allow_empty_filters=False,
+        modified_since: Optional[str] = None,
+        with_last_modified=False,
+        compact_rows=False
     ) -> List[Dict]:
         # Early exit if record_ids, external_ids, and names are provided but are all empty
         # This is done for cases where we pass an empty list or set after processing a batch looking for ids/external ids/names
         # Otherwise, we would simply not construct where clauses, and pull back everything.
-        if not record_ids and not external_ids and not names and not entity_ids and not item_ids and allow_empty_filters == False:
+        if not record_ids and not external_ids and not names and not entity_ids and not item_ids and not modified_since and allow_empty_filters == False:
             return True, None, []
 
         select_clause = self.ref_select_clauses[record_type]
-        where_clause = ""
+        last_modified_field = self.ref_last_modified_fields.get(record_type)
+        if with_last_modified and last_modified_field:
+            select_clause += f", TO_CHAR({last_modified_field}, 'YYYY-MM-DD HH24:MI:SS') as lastmodified"
+
+        query = f"SELECT {select_clause} FROM {record_type}"
+
+        if record_type in self.ref_join_clauses:
+            query += f" {self.ref_join_clauses[record_type]}"
+
+        # full table loads and incremental refreshes always read from NetSuite
+        use_query_cache = self.query_cache is not None and not modified_since and not with_last_modified
+        lookups = {
+            "internalId": list(record_ids or []),
+            "externalId": list(external_ids or []),
+            "name": list(names or []) if record_type in self.ref_name_where_clauses else [],
+            "entityId": list(entity_ids or []),
+            "itemId": list(item_ids or [])
+        }
+        use_query_cache = use_query_cache and any(lookups.values())
+        cached_items = []
+        if use_query_cache:
+            cached_items, lookups = self._read_query_cache(record_type, query, lookups)
+            if not any(lookups.values()):
+                return True, None, self._unique_rows(cached_items)
+            record_ids, external_ids, names = lookups["internalId"], lookups["externalId"], lookups["name"]
+            entity_ids, item_ids = lookups["entityId"], lookups["itemId"]
+
+        filters = []
+        conditions = []
 
         if record_ids:
-            id_string = ",".join(str(id) for id in record_ids)
-            where_clause = f"WHERE id IN ({id_string})"
+            filters.append(("id", [str(id) for id in record_ids]))
 
         if external_ids:
-            external_id_string = ",".join(f"'{id}'" for id in external_ids)
-
-            if where_clause:
-                where_clause = f"{where_clause} OR externalId IN ({external_id_string})"
-            else:
-                where_clause = f"WHERE externalId IN ({external_id_string})"
+            filters.append(("externalId", [f"'{id}'" for id in external_ids]))
 
         if names and record_type in self.ref_name_where_clauses:
-            names_string = ",".join(f"'{id}'" for id in names)
-
-            if where_clause:
-                where_clause = f"{where_clause} OR {self.ref_name_where_clauses[record_type]} IN ({names_string})"
-            else:
-                where_clause = f"WHERE {self.ref_name_where_clauses[record_type]} IN ({names_string})"
+            filters.append((self.ref_name_where_clauses[record_type], [f"'{id}'" for id in names]))
 
         if entity_ids:
-            entity_id_string = ",".join(f"'{id}'" for id in entity_ids)
-
-            if where_clause:
-                where_clause = f"{where_clause} OR entityId IN ({entity_id_string})"
-            else:
-                where_clause = f"WHERE entityId IN ({entity_id_string})"
+            filters.append(("entityId", [f"'{id}'" for id in entity_ids]))
 
         if item_ids:
-            item_ids_str = ",".join(f"'{id}'" for id in item_ids)
-
-            if where_clause:
-                where_clause = f"{where_clause} OR itemId IN ({item_ids_str})"
-            else:
-                where_clause = f"WHERE itemId IN ({item_ids_str})"
-
-        query = f"SELECT {select_clause} FROM {record_type}"
-
-        if record_type in self.ref_join_clauses:
-            query += f" {self.ref_join_clauses[record_type]}"
-
-        if where_clause:
-            query += f" {where_clause}"
+            filters.append(("itemId", [f"'{id}'" for id in item_ids]))
 
-        all_items = []
-        offset = 0
-        limit = min(page_size, 1000)
-        has_more = True
-
-        while has_more:
-            query_data = {"q": query}
-            params = {"offset": offset, "limit": limit}
-            headers = {"Prefer": "transient"}
-
-            response = self._make_request(
-                url=self.suiteql_url,
-                method="POST",
-                data=query_data,
-                params=params,
-                headers=headers
-            )
+        if modified_since and last_modified_field:
+            conditions.append(f"{last_modified_field} >= TO_TIMESTAMP('{modified_since}', 'YYYY-MM-DD HH24:MI:SS')")
 
-            success, error_message = self._validate_response(response)
-            if not success:
-                return success, error_message, []
+        queries = self._plan_suiteql_queries(query, filters, conditions)
+        success, error_message, all_items = self._run_suiteql_queries(
+            queries, page_size, dedupe_key=self._internal_id_key, row_hook=self._row_hook(self.ref_field_names, compact=compact_rows)
+        )
+        if not success:
+            return success, error_message, []
 
-            resp_json = response.json()
-            items = resp_json.get("items", [])
+        if use_query_cache:
+            self._write_query_cache(record_type, query, lookups, all_items)
+            return True, None, self._unique_rows(cached_items + all_items)
 
-            # SuiteQL response fields come in as lower case,
-            # even when using `AS` syntax that includes capital letters
-            for item in items:
-                if "internalid" in item:
-                    item["internalId"] = item.pop("internalid")
-                if "externalid" in item:
-                    item["externalId"] = item.pop("externalid")
-                if "subsidiaryid" in item:
-                    item["subsidiaryId"] = item.pop("subsidiaryid")
-                if "entityid" in item:
-                    item["entityId"] = item.pop("entityid")
-                if "itemid" in item:
-                    item["itemId"] = item.pop("itemid")
-                if "taxtype" in item:
-                    item["taxType"] = item.pop("taxtype")
-                if "taxrate" in item:
-                    item["taxRate"] = item.pop("taxrate")
+        return True, None, all_items
 
-            all_items.extend(items)
+    def get_reference_ids(self, record_type) -> Set[str]:
+        """Returns the internal ids of every row of a reference table, used to reconcile deleted rows"""
+        query = f"SELECT {record_type}.id as internalid FROM {record_type}"
 
-            has_more = resp_json.get("hasMore", False)
-            offset += limit
+        success, error_message, items = self._fetch_suiteql_rows(query)
+        if not success:
+            return success, error_message, set()
 
-        return True, None, all_items
+        return True, None, {str(item["internalid"]) for item in items}
 
     def get_purchase_order_items(self, purchase_order_ids):
         if not purchase_order_ids:
             return True, None, {}
 
-        purchase_order_ids_string = ",".join(f"'{id}'" for id in purchase_order_ids)
+        query = f"SELECT {self.transaction_line_columns} FROM transaction t inner join transactionLine tl on tl.transaction = t.id"
+        filters = [("t.id", [f"'{id}'" for id in purchase_order_ids])]
 
-        query = f"SELECT t.recordtype, tl.* FROM transaction t inner join transactionLine tl on tl.transaction = t.id WHERE mainline <> 'T' AND t.type = 'PurchOrd' AND t.id IN ({purchase_order_ids_string})"
-
-        query_data = {"q": query}
-        headers = {"Prefer": "transient"}
-
-        response = self._make_request(
-            url=self.suiteql_url,
-            method="POST",
-            data=query_data,
-            params={},
-            headers=headers
-        )
-
-        success, error_message = self._validate_response(response)
+        queries = self._plan_suiteql_queries(query, filters, ["mainline <> 'T'", "t.type = 'PurchOrd'"])
+        success, error_message, items = self._run_suiteql_queries(queries)
         if not success:
             return success, error_message, {}
 
-        resp_json = response.json()
-        items = resp_json.get("items", [])
         result = defaultdict(lambda: {"lineItems": []})
 
         for item in items:
@@ -368,37 +630,25 @@ class SuiteTalkRestClient:
 
         return True, None, dict(result)
 
-    def get_invoice_items(self, invoice_ids: List[str]):
-        if invoice_ids is not None and not invoice_ids:
+    def get_invoice_items(self, invoice_ids: List[str], transaction_queries: Optional[List[str]] = None):
+        if (invoice_ids is not None or transaction_queries is not None) and not invoice_ids and not transaction_queries:
             return True, None, {}
 
-        where_clause = ""
+        filters = []
 
         if invoice_ids:
-            invoice_id_string = ",".join(f"'{id}'" for id in invoice_ids)
-            where_clause = f"AND t.id IN ({invoice_id_string})"
-
-        query = "SELECT t.recordtype, tl.* FROM transaction t inner join transactionLine tl on tl.transaction = t.id WHERE mainline <> 'T'"
-        if where_clause:
-            query += f" {where_clause}"
+            filters.append(("t.id", [f"'{id}'" for id in invoice_ids]))
 
-        query_data = {"q": query}
-        headers = {"Prefer": "transient"}
+        for transaction_query in transaction_queries or []:
+            filters.append(("t.id", [transaction_query]))
 
-        response = self._make_request(
-            url=self.suiteql_url,
-            method="POST",
-            data=query_data,
-            params={},
-            headers=headers
-        )
+        query = f"SELECT {self.transaction_line_columns} FROM transaction t inner join transactionLine tl on tl.transaction = t.id"
 
-        success, error_message = self._validate_response(response)
+        queries = self._plan_suiteql_queries(query, filters, ["mainline <> 'T'"])
+        success, error_message, items = self._run_suiteql_queries(queries, dedupe_key=self._transaction_link_key, max_rows=self._row_budget(filters))
         if not success:
             return success, error_message, {}
 
-        resp_json = response.json()
-        items = resp_json.get("items", [])
         result = defaultdict(lambda: {"lineItems": []})
 
         for item in items:
@@ -408,37 +658,25 @@ class SuiteTalkRestClient:
 
         return True, None, dict(result)
 
-    def get_bill_items(self, bill_ids: List[str]):
-        if bill_ids is not None and not bill_ids:
+    def get_bill_items(self, bill_ids: List[str], transaction_queries: Optional[List[str]] = None):
+        if (bill_ids is not None or transaction_queries is not None) and not bill_ids and not transaction_queries:
             return True, None, {}
 
-        where_clause = ""
+        filters = []
 
         if bill_ids:
-            bill_id_string = ",".join(f"'{id}'" for id in bill_ids)
-            where_clause = f"AND t.id IN ({bill_id_string})"
-
-        query = "SELECT t.recordtype, tl.* FROM transaction t inner join transactionLine tl on tl.transaction = t.id WHERE mainline <> 'T'"
-        if where_clause:
-            query += f" {where_clause}"
+            filters.append(("t.id", [f"'{id}'" for id in bill_ids]))
 
-        query_data = {"q": query}
-        headers = {"Prefer": "transient"}
+        for transaction_query in transaction_queries or []:
+            filters.append(("t.id", [transaction_query]))
 
-        response = self._make_request(
-            url=self.suiteql_url,
-            method="POST",
-            data=query_data,
-            params={},
-            headers=headers
-        )
+        query = f"SELECT {self.transaction_line_columns} FROM transaction t inner join transactionLine tl on tl.transaction = t.id"
 
-        success, error_message = self._validate_response(response)
+        queries = self._plan_suiteql_queries(query, filters, ["mainline <> 'T'"])
+        success, error_message, items = self._run_suiteql_queries(queries, dedupe_key=self._transaction_link_key, max_rows=self._row_budget(filters))
         if not success:
             return success, error_message, {}
 
-        resp_json = response.json()
-        items = resp_json.get("items", [])
         result = defaultdict(lambda: {"lineItems": [], "expenses": []})
 
         for item in items:
@@ -452,27 +690,14 @@ class SuiteTalkRestClient:
         if not vendor_credit_ids:
             return True, None, {}
 
-        vendor_credit_ids_string = ",".join(f"'{id}'" for id in vendor_credit_ids)
-
-        query = f"SELECT t.recordtype, tl.* FROM transaction t inner join transactionLine tl on tl.transaction = t.id WHERE mainline <> 'T' AND t.recordtype = 'vendorcredit' AND t.id IN ({vendor_credit_ids_string})"
-
-        query_data = {"q": query}
-        headers = {"Prefer": "transient"}
+        query = f"SELECT {self.transaction_line_columns} FROM transaction t inner join transactionLine tl on tl.transaction = t.id"
+        filters = [("t.id", [f"'{id}'" for id in vendor_credit_ids])]
 
-        response = self._make_request(
-            url=self.suiteql_url,
-            method="POST",
-            data=query_data,
-            params={},
-            headers=headers
-        )
-
-        success, error_message = self._validate_response(response)
+        queries = self._plan_suiteql_queries(query, filters, ["mainline <> 'T'", "t.recordtype = 'vendorcredit'"])
+        success, error_message, items = self._run_suiteql_queries(queries)
         if not success:
             return success, error_message, {}
 
-        resp_json = response.json()
-        items = resp_json.get("items", [])
         result = defaultdict(lambda: {"lineItems": [], "expenses": []})
 
         for item in items:
@@ -482,60 +707,38 @@ class SuiteTalkRestClient:
 
         return True, None, dict(result)
 
-    def get_invoice_payments(self, invoice_ids: Optional[Set]=None, ids: Optional[Set]=None, external_ids: Optional[Set]=None, tran_ids: Optional[Set]=None, aggregate_payments: Optional[bool]=True):
-        if invoice_ids is not None and not invoice_ids and not tran_ids:
+    def get_invoice_payments(self, invoice_ids: Optional[Set]=None, ids: Optional[Set]=None, external_ids: Optional[Set]=None, tran_ids: Optional[Set]=None, aggregate_payments: Optional[bool]=True, transaction_queries: Optional[List[str]]=None):
+        if (invoice_ids is not None or transaction_queries is not None) and not invoice_ids and not tran_ids and not transaction_queries:
             return True, None, {}
 
-        where_clauses = []
+        filters = []
 
         if invoice_ids:
-            external_id_string = ",".join(f"'{id}'" for id in invoice_ids)
-            where_clauses.append(f"NTLL.PreviousDoc in ({external_id_string})")
+            filters.append(("NTLL.PreviousDoc", [f"'{id}'" for id in invoice_ids]))
+
+        for transaction_query in transaction_queries or []:
+            filters.append(("NTLL.PreviousDoc", [transaction_query]))
 
         if tran_ids:
-            tran_id_string = ",".join(f"'{id}'" for id in tran_ids)
-            where_clauses.append(f"NT.tranid in ({tran_id_string})")
+            filters.append(("NT.tranid", [f"'{id}'" for id in tran_ids]))
 
         if ids:
-            ids_string = ",".join(f"{id}" for id in ids)
-            where_clauses.append(f"NT.ID in ({ids_string})")
+            filters.append(("NT.ID", [f"{id}" for id in ids]))
 
         if external_ids:
-            external_ids_string = ",".join(f"'{id}'" for id in external_ids)
-            where_clauses.append(f"NT.externalId in ({external_ids_string})")
-
-        query = "SELECT DISTINCT NTLL.PreviousDoc transaction, NT.ID ID, NT.ID internalId, NT.externalId, NT.tranid, NT.transactionNumber, NT.account account, NT.TranDate, NT.Type, BUILTIN.DF(NT.Status) status, NT.ForeignTotal amount, currency, exchangeRate FROM NextTransactionLineLink AS NTLL INNER JOIN Transaction AS NT ON (NT.ID = NTLL.NextDoc) WHERE NT.recordtype = 'customerpayment'"
-        if where_clauses:
-            where_statement = " OR ".join(where_clauses)
-            query += f" AND ({where_statement})"
+            filters.append(("NT.externalId", [f"'{id}'" for id in external_ids]))
 
-        query_data = {"q": query}
-        headers = {"Prefer": "transient"}
+        query = "SELECT DISTINCT NTLL.PreviousDoc transaction, NT.ID ID, NT.ID internalId, NT.externalId, NT.tranid, NT.transactionNumber, NT.account account, NT.TranDate, NT.Type, BUILTIN.DF(NT.Status) status, NT.ForeignTotal amount, currency, exchangeRate FROM NextTransactionLineLink AS NTLL INNER JOIN Transaction AS NT ON (NT.ID = NTLL.NextDoc)"
 
-        response = self._make_request(
-            url=self.suiteql_url,
-            method="POST",
-            data=query_data,
-            params={},
-            headers=headers
+        queries = self._plan_suiteql_queries(query, filters, ["NT.recordtype = 'customerpayment'"])
+        success, error_message, payments = self._run_suiteql_queries(
+            queries, dedupe_key=self._transaction_link_key, row_hook=None if aggregate_payments else self._row_hook(self.payment_field_names),
+            max_rows=self._row_budget(filters)
         )
-
-        success, error_message = self._validate_response(response)
         if not success:
             return success, error_message, {}
 
-        resp_json = response.json()
-        payments = resp_json.get("items", [])
-
         if not aggregate_payments:
-            for payment in payments:
-                if "internalid" in payment:
-                    payment["internalId"] = payment.pop("internalid")
-                if "externalid" in payment:
-                    payment["externalId"] = payment.pop("externalid")
-                if "tranid" in payment:
-                    payment["tranId"] = payment.pop("tranid")
-
             return True, None, payments
 
         result = defaultdict(lambda: {"payments": []})
@@ -546,60 +749,38 @@ class SuiteTalkRestClient:
 
         return True, None, dict(result)
 
-    def get_bill_payments(self, bill_ids: Optional[Set]=None, ids: Optional[Set]=None, external_ids: Optional[Set]=None, tran_ids: Optional[Set]=None, aggregate_payments: Optional[bool]=True):
-        if bill_ids is not None and not bill_ids and not tran_ids:
+    def get_bill_payments(self, bill_ids: Optional[Set]=None, ids: Optional[Set]=None, external_ids: Optional[Set]=None, tran_ids: Optional[Set]=None, aggregate_payments: Optional[bool]=True, transaction_queries: Optional[List[str]]=None):
+        if (bill_ids is not None or transaction_queries is not None) and not bill_ids and not tran_ids and not transaction_queries:
             return True, None, {}
 
-        where_clauses = []
+        filters = []
 
         if bill_ids:
-            external_id_string = ",".join(f"'{id}'" for id in bill_ids)
-            where_clauses.append(f"NTLL.PreviousDoc in ({external_id_string})")
+            filters.append(("NTLL.PreviousDoc", [f"'{id}'" for id in bill_ids]))
+
+        for transaction_query in transaction_queries or []:
+            filters.append(("NTLL.PreviousDoc", [transaction_query]))
 
         if ids:
-            ids_string = ",".join(f"{id}" for id in ids)
-            where_clauses.append(f"NT.ID in ({ids_string})")
+            filters.append(("NT.ID", [f"{id}" for id in ids]))
 
         if tran_ids:
-            tran_id_string = ",".join(f"'{id}'" for id in tran_ids)
-            where_clauses.append(f"NT.tranid in ({tran_id_string})")
+            filters.append(("NT.tranid", [f"'{id}'" for id in tran_ids]))
 
         if external_ids:
-            external_ids_string = ",".join(f"'{id}'" for id in external_ids)
-            where_clauses.append(f"NT.externalId in ({external_ids_string})")
-
-        query = "SELECT DISTINCT NTLL.PreviousDoc transaction, NT.ID ID, NT.ID internalId, NT.tranid, NT.externalId, NT.transactionNumber, NT.account account, NT.TranDate, NT.Type, BUILTIN.DF(NT.Status) status, NT.ForeignTotal amount, currency, exchangeRate FROM NextTransactionLineLink AS NTLL INNER JOIN Transaction AS NT ON (NT.ID = NTLL.NextDoc) WHERE NT.recordtype = 'vendorpayment'"
-        if where_clauses:
-            where_statement = " OR ".join(where_clauses)
-            query += f" AND ({where_statement})"
+            filters.append(("NT.externalId", [f"'{id}'" for id in external_ids]))
 
-        query_data = {"q": query}
-        headers = {"Prefer": "transient"}
+        query = "SELECT DISTINCT NTLL.PreviousDoc transaction, NT.ID ID, NT.ID internalId, NT.tranid, NT.externalId, NT.transactionNumber, NT.account account, NT.TranDate, NT.Type, BUILTIN.DF(NT.Status) status, NT.ForeignTotal amount, currency, exchangeRate FROM NextTransactionLineLink AS NTLL INNER JOIN Transaction AS NT ON (NT.ID = NTLL.NextDoc)"
 
-        response = self._make_request(
-            url=self.suiteql_url,
-            method="POST",
-            data=query_data,
-            params={},
-            headers=headers
+        queries = self._plan_suiteql_queries(query, filters, ["NT.recordtype = 'vendorpayment'"])
+        success, error_message, payments = self._run_suiteql_queries(
+            queries, dedupe_key=self._transaction_link_key, row_hook=None if aggregate_payments else self._row_hook(self.payment_field_names),
+            max_rows=self._row_budget(filters)
         )
-
-        success, error_message = self._validate_response(response)
         if not success:
             return success, error_message, {}
 
-        resp_json = response.json()
-        payments = resp_json.get("items", [])
-
         if not aggregate_payments:
-            for payment in payments:
-                if "internalid" in payment:
-                    payment["internalId"] = payment.pop("internalid")
-                if "externalid" in payment:
-                    payment["externalId"] = payment.pop("externalid")
-                if "tranid" in payment:
-                    payment["tranId"] = payment.pop("tranid")
-
             return True, None, payments
 
         result = defaultdict(lambda: {"payments": []})
@@ -614,38 +795,26 @@ class SuiteTalkRestClient:
         if not entity_ids:
             return True, None, {}
 
-        entity_ids_str = ",".join(map(str, entity_ids))
         entity_id_field = f"{entity_type}.id"
         addressbook_table = f"{entity_type}addressbook"
         addressbook_entity_address_table = f"{entity_type}addressbookentityaddress"
 
+        address_columns = ", ".join(f"{addressbook_entity_address_table}.{column}" for column in self.address_columns)
         query = (
-            f"SELECT {entity_id_field} as entityid, {addressbook_entity_address_table}.*, "
+            f"SELECT {entity_id_field} as entityid, {address_columns}, "
             f"{addressbook_table}.defaultshipping, {addressbook_table}.defaultbilling "
             f"FROM {entity_type} "
             f"JOIN {addressbook_table} ON ({entity_id_field} = {addressbook_table}.entity) "
-            f"JOIN {addressbook_entity_address_table} ON ({addressbook_table}.addressbookaddress = {addressbook_entity_address_table}.nkey) "
-            f"WHERE {entity_id_field} IN ({entity_ids_str}) AND "
-            f"({addressbook_table}.defaultbilling = 'T' OR {addressbook_table}.defaultshipping = 'T')"
+            f"JOIN {addressbook_entity_address_table} ON ({addressbook_table}.addressbookaddress = {addressbook_entity_address_table}.nkey)"
         )
+        filters = [(entity_id_field, [str(id) for id in entity_ids])]
+        conditions = [f"({addressbook_table}.defaultbilling = 'T' OR {addressbook_table}.defaultshipping = 'T')"]
 
-        query_data = {"q": query}
-        headers = {"Prefer": "transient"}
-
-        response = self._make_request(
-            url=self.suiteql_url,
-            method="POST",
-            data=query_data,
-            headers=headers
-        )
-
-        success, error_message = self._validate_response(response)
+        queries = self._plan_suiteql_queries(query, filters, conditions)
+        success, error_message, items = self._run_suiteql_queries(queries)
         if not success:
             return success, error_message, []
 
-        resp_json = response.json()
-        items = resp_json.get("items", [])
-
         default_addresses = {entity_id: {"billing": None, "shipping": None} for entity_id in entity_ids}
 
         for item in items:
@@ -658,41 +827,371 @@ class SuiteTalkRestClient:
 
         return True, None, default_addresses
 
-    def _make_request(self, url, method, data=None, params=None, headers=None):
+    def _read_query_cache(self, record_type: str, query: str, lookups: Dict[str, list]):
+        """Returns the cached rows of the looked up keys and, per row field, the keys still to query"""
+        columns = self.query_cache.fingerprint(query)
+        cached_rows = []
+        missing = {}
+        for field, values in lookups.items():
+            values_by_key = {str(value): value for value in values}
+            hits = self.query_cache.get_many(record_type, columns, field, list(values_by_key))
+            for rows in hits.values():
+                cached_rows.extend(rows)
+            missing[field] = [value for key, value in values_by_key.items() if key not in hits]
+        return cached_rows, missing
+
+    def _write_query_cache(self, record_type: str, query: str, lookups: Dict[str, list], rows: List[dict]) -> None:
+        columns = self.query_cache.fingerprint(query)
+        for field, values in lookups.items():
+            keys = {str(value) for value in values}
+            rows_by_key = {}
+            for row in rows:
+                value = row.get(field)
+                if value is not None and str(value) in keys:
+                    rows_by_key.setdefault(str(value), []).append(row)
+            self.query_cache.put_many(record_type, columns, field, rows_by_key)
+
+    def _invalidate_query_cache(self, record_id, record: dict) -> None:
+        if self.query_cache is None:
+            return
+        keys = [record.get(field) for field in self.query_cache_key_fields if isinstance(record.get(field), (str, int))]
+        self.query_cache.invalidate(internal_ids=[record_id], keys=keys)
+
+    @staticmethod
+    def _unique_rows(rows: List[dict]) -> List[dict]:
+        unique_rows = {}
+        for row in rows:
+            unique_rows.setdefault(str(row.get("internalId")), row)
+        return list(unique_rows.values())
+
+    @property
+    def max_rows_per_query(self) -> int:
+        """Row budget of a single SuiteQL query, 0 disables it"""
+        return int(self.config.get("max_rows_per_query", self.default_max_rows_per_query))
+
+    def _row_budget(self, filters: List[tuple]) -> int:
+        """The row budget of a lookup, only lookups without key filters are limited"""
+        return 0 if filters else self.max_rows_per_query
+
+    @property
+    def max_query_length(self) -> int:
+        return int(self.config.get("suiteql_max_query_length") or self.default_max_query_length)
+
+    def _plan_suiteql_queries(self, query: str, filters: List[tuple], conditions: Optional[List[str]] = None, reserved_length=0) -> List[str]:
+        """Splits a lookup into the SuiteQL queries needed to stay within the statement limits
+
+        `filters` are `(column, values)` pairs whose IN clauses are OR-ed together and
+        `conditions` are AND-ed with them. A lookup that fits in one statement is a single
+        query, otherwise every filter is split in chunks sized to the room the rest of the
+        statement leaves, and each chunk becomes a query of its own. `reserved_length` keeps room
+        for the statement a query is embedded in when it is used as a subquery.
+        """
+        max_query_length = self.max_query_length - reserved_length
+        filters = [(column, values) for column, values in filters if values]
+        conditions = conditions or []
+
+        single_query = self._build_suiteql_query(query, filters, conditions)
+        if len(single_query) <= max_query_length and all(len(values) <= self.max_in_list_size for _, values in filters):
+            return [single_query]
+
+        queries = []
+        for column, values in filters:
+            budget = max_query_length - len(self._build_suiteql_query(query, [(column, [])], conditions))
+            for chunk in self._chunk_in_list(values, budget):
+                queries.append(self._build_suiteql_query(query, [(column, chunk)], conditions))
+
+        return queries
+
+    def _build_suiteql_query(self, query: str, filters: List[tuple], conditions: List[str]) -> str:
+        clauses = list(conditions)
+        if filters:
+            in_clauses = " OR ".join(f"{column} IN ({','.join(values)})" for column, values in filters)
+            clauses.append(f"({in_clauses})")
+
+        if clauses:
+            query += f" WHERE {' AND '.join(clauses)}"
+
+        return query
+
+    def _chunk_in_list(self, values: List[str], budget: int) -> List[List[str]]:
+        """Splits rendered IN list values in chunks of at most `max_in_list_size` values and `budget` characters"""
+        chunks = []
+        chunk = []
+        chunk_length = 0
+
+        for value in values:
+            # every value after the first one is preceded by a comma
+            value_length = len(value) + (1 if chunk else 0)
+            if chunk and (len(chunk) >= self.max_in_list_size or chunk_length + value_length > budget):
+                chunks.append(chunk)
+                chunk = []
+                chunk_length = 0
+                value_length = len(value)
+            chunk.append(value)
+            chunk_length += value_length
+
+        if chunk:
+            chunks.append(chunk)
+
+        return chunks
+
+    def _run_suiteql_queries(self, queries: List[str], page_size=1000, dedupe_key=None, row_hook=None, max_rows=0):
+        """Runs the queries of a lookup concurrently and merges their rows in query order
+
+        Rows matched by several chunks (e.g. by id and by externalId) are only kept once when a `dedupe_key` is given.
+        The concurrency limit is shared between the queries, each of them fetches its pages
+        within its share so the chunks and their pages don't queue on the governor.
+        """
+        if len(queries) == 1:
+            return self._fetch_suiteql_rows(queries[0], page_size, max_rows=max_rows, row_hook=row_hook)
+
+        max_workers = max(min(self.governor.concurrency_limit, len(queries)), 1)
+        window = max(self.governor.concurrency_limit // max_workers, 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda query: self._fetch_suiteql_rows(query, page_size, max_rows=max_rows, window=window, row_hook=row_hook), queries))
+
+        all_items = []
+        seen_keys = set()
+        for success, error_message, items in results:
+            if not success:
+                return success, error_message, []
+            for item in items:
+                key = dedupe_key(item) if dedupe_key is not None else None
+                if key is not None:
+                    if key in seen_keys:
+                        continue
+                    seen_keys.add(key)
+                all_items.append(item)
+
+        return True, None, all_items
+
+    @staticmethod
+    def _internal_id_key(row: dict):
+        internal_id = row.get("internalId", row.get("internalid"))
+        return str(internal_id) if internal_id is not None else None
+
+    @staticmethod
+    def _transaction_link_key(row: dict):
+        # line and payment rows are unique per (transaction, line or payment id)
+        return (row.get("transaction"), row.get("id"))
+
+    @staticmethod
+    def _row_hook(rename: Optional[Dict[str, str]] = None, compact=False):
+        """Builds the rows of a SuiteQL page from their `(key, value)` pairs
+
+        Keys are renamed with `rename`. Compact rows are `ReferenceRow`s without the
+        per row `links` SuiteQL adds, used for the rows kept for the whole run.
+        """
+        rename = rename or {}
+        if compact:
+            return lambda pairs: ReferenceRow.from_pairs([(rename.get(key, key), value) for key, value in pairs if key != "links"])
+        if rename:
+            return lambda pairs: {rename.get(key, key): value for key, value in pairs}
+        return None
+
+    def _fetch_suiteql_page(self, query, offset, limit, row_hook=None):
+        """Requests a page of a SuiteQL query, its body is decoded as it is read (see `SuiteQLPageDecoder`)"""
+        response = self._make_request(
+            url=self.suiteql_url,
+            method="POST",
+            data={"q": query},
+            params={"offset": offset, "limit": limit},
+            headers={"Prefer": "transient"},
+            stream=True
+        )
+
+        try:
+            success, error_message = self._validate_response(response)
+            if not success:
+                return success, error_message, {}
+
+            decoder = SuiteQLPageDecoder(row_hook)
+            for chunk in response.iter_content(chunk_size=self.stream_chunk_size):
+                decoder.feed(chunk)
+            return True, None, decoder.close()
+        finally:
+            response.close()
+
+    def _iter_suiteql_pages(self, query, page_size=1000, max_rows=0, window=None, row_hook=None):
+        """Yields `(success, error_message, rows)` for every page of a SuiteQL query as it arrives
+
+        Pages are fetched ahead of the consumer: once the first page tells how many rows the
+        query returns (`totalResults`), up to `window` pages (the concurrency limit by default)
+        are requested in parallel, otherwise the next page is requested while the current one
+        is consumed.
+        Pages are yielded in offset order, a failed page is yielded once and ends the query.
+        Closing the generator early (e.g. breaking out of the loop) cancels the pages that
+        weren't requested yet.
+
+        A query returning more than `max_rows` rows (0 for no limit) is refused: it fails as soon
+        as `totalResults` or the rows read so far go over the budget.
+        Rows are built by `row_hook` while the pages are decoded (see `_row_hook`).
+        """
+        limit = min(page_size, 1000)
+        window = max(window or self.governor.concurrency_limit, 1)
+        executor = ThreadPoolExecutor(max_workers=window)
+        pending = deque([executor.submit(self._fetch_suiteql_page, query, 0, limit, row_hook)])
+        next_offset = limit
+        total_results = None
+        row_count = 0
+
+        try:
+            while pending:
+                success, error_message, page = pending.popleft().result()
+                if not success:
+                    yield success, error_message, []
+                    return
+
+                if total_results is None:
+                    total_results = page.get("totalResults")
+
+                items = page.get("items", [])
+                row_count += len(items)
+                if max_rows and max(row_count, total_results or 0) > max_rows:
+                    error_message = f"SuiteQL query returns {max(row_count, total_results or 0)} rows or more, over the max_rows_per_query budget of {max_rows}"
+                    self.logger.error(f"{error_message}: {query[:500]}")
+                    yield False, error_message, []
+                    return
+
+                if total_results is not None:
+                    while len(pending) < window and next_offset < total_results:
+                        pending.append(executor.submit(self._fetch_suiteql_page, query, next_offset, limit, row_hook))
+                        next_offset += limit
+                elif page.get("hasMore", False):
+                    pending.append(executor.submit(self._fetch_suiteql_page, query, next_offset, limit, row_hook))
+                    next_offset += limit
+
+                yield True, None, items
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _fetch_suiteql_rows(self, query, page_size=1000, max_rows=0, window=None, row_hook=None):
+        """Runs a SuiteQL query and returns the rows of every page"""
+        all_items = []
+        for success, error_message, items in self._iter_suiteql_pages(query, page_size, max_rows, window, row_hook):
+            if not success:
+                return success, error_message, []
+            all_items.extend(items)
+
+        return True, None, all_items
+
+    def _make_request(self, url, method, data=None, params=None, headers=None, stream=False):
         request_headers = {"Content-Type": "application/json"}
         if headers:
             request_headers.update(headers)
 
         request_params = params or {}
 
-        ns_account = self.config["ns_account"].replace("-", "_").upper()
-
-        oauth = OAuth1(
-            client_key=self.config["ns_consumer_key"],
-            client_secret=self.config["ns_consumer_secret"],
-            resource_owner_key=self.config["ns_token_key"],
-            resource_owner_secret=self.config["ns_token_secret"],
-            realm=ns_account,
-            signature_method=oauth1.SIGNATURE_HMAC_SHA256,
-        )
-
         json_data = json.dumps(data, cls=HGJSONEncoder) if data else None
-
-        res = requests.request(
-            method=method,
-            url=url,
-            params=request_params,
-            headers=request_headers,
-            data=json_data,
-            verify=True,
-            auth=oauth
-        )
+        endpoint = self._endpoint_name(url, method)
+
+        attempt = 0
+        while True:
+            slot = ExitStack()
+            slot.enter_context(self.governor.slot(endpoint))
+            try:
+                res = self.session.request(
+                    method=method,
+                    url=url,
+                    params=request_params,
+                    headers=request_headers,
+                    data=json_data,
+                    verify=True,
+                    auth=self.oauth,
+                    timeout=self.timeout,
+                    stream=stream
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                slot.close()
+                if not self._should_retry_error(e, url, method):
+                    # the request may have reached NetSuite and created the record, a retry could duplicate it
+                    self.logger.error(f"Error when making request: {method} {url}: {e.__class__.__name__} {e}")
+                    return self._error_response(method, url, e)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.governor.backoff(attempt)
+                self.logger.warning(f"{method} {url} failed with {e.__class__.__name__}, retrying in {delay:.1f}s")
+            except BaseException:
+                slot.close()
+                raise
+            else:
+                if attempt >= self.max_retries or not self._should_retry(res, url, method):
+                    if stream:
+                        self._release_slot_on_close(res, slot)
+                    else:
+                        slot.close()
+                    break
+                if self._is_throttled(res):
+                    self.governor.record(endpoint, throttled=1)
+                delay = self.governor.backoff(attempt, self.governor.parse_retry_after(res.headers.get("Retry-After")))
+                self.logger.warning(f"{method} {url} returned {res.status_code}, retrying in {delay:.1f}s")
+                # an unread streamed response holds its pool connection, and the pool blocks once every connection is held
+                res.close()
+                slot.close()
+
+            self.governor.record(endpoint, retries=1, wait_time=delay)
+            time.sleep(delay)
+            attempt += 1
 
         if res.status_code >= 400:
             self.logger.error(f"Error when making request: {res.request.method} {res.request.url} {res.request.body}: {res.status_code} {res.reason} {res.text}")
 
         return res
 
+    @staticmethod
+    def _release_slot_on_close(response: requests.Response, slot: ExitStack) -> None:
+        """Keeps the governor slot of a streamed response until its body is read and the response closed"""
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                slot.close()
+
+        response.close = close_and_release
+
+    def _is_throttled(self, response: requests.Response) -> bool:
+        if response.status_code == 429:
+            return True
+        return response.status_code >= 400 and "CONCURRENCY_LIMIT_EXCEEDED" in response.text
+
+    def _should_retry(self, response: requests.Response, url: str, method: str) -> bool:
+        if self._is_throttled(response):
+            return True
+        # a 5xx on a write may still have created the record, so only reads and idempotent writes are retried
+        if response.status_code >= 500:
+            return method != "POST" or url == self.suiteql_url
+        return False
+
+    def _should_retry_error(self, error: Exception, url: str, method: str) -> bool:
+        # only a failed connection is known not to have reached NetSuite, other POST writes aren't retried
+        if method != "POST" or url == self.suiteql_url:
+            return True
+        return isinstance(error, requests.exceptions.ConnectTimeout)
+
+    def _error_response(self, method: str, url: str, error: Exception) -> requests.Response:
+        """A response standing for a request that failed without one, it reads like a NetSuite error"""
+        response = requests.Response()
+        response.status_code = 599
+        response.url = url
+        response.reason = error.__class__.__name__
+        response._content = json.dumps({
+            "o:errorDetails": [{"detail": f"{method} {url} failed with {error.__class__.__name__}: {error}"}]
+        }).encode()
+        return response
+
+    def _endpoint_name(self, url: str, method: str) -> str:
+        path = url[len(self.url_prefix):].strip("/").split("/") if url.startswith(self.url_prefix) else [url]
+        if path[:2] == ["record", "v1"] and len(path) > 2:
+            return f"{method} record/{path[2]}"
+        if path[:2] == ["async", "v1"]:
+            # job and task ids are left out, metrics are kept per kind of request
+            return f"{method} async/v1/{'/'.join(part for part in path[2:] if not part.isdigit())}"
+        return f"{method} {'/'.join(path)}"
+
     def _validate_response(self, response: requests.Response) -> tuple[bool, str | None]:
         if response.status_code >= 400:
             msg = self._response_error_message(response)
@@ -0,0 +1,259 @@
+import re
+import threading
+import time
+
+from typing import List, Optional
+
+from netsuitesdk import NetSuiteConnection, NetSuiteRateLimitError
+from target_netsuite_v2.governor import RequestGovernor
+
+
+class UnsupportedSoapPayloadError(Exception):
+    """A REST payload that can't be expressed as a SOAP record, it is written over REST instead"""
+
+
+class SuiteTalkSoapClient:
+    """Writes records in bulk with the SuiteTalk SOAP list operations (through netsuitesdk)
+
+    The REST payloads built by the mappers are translated to SOAP records by walking the
+    WSDL type of the record: `{"id": ...}` references become `RecordRef`s, `{"items": [...]}`
+    sublists become `<Record><Sublist>List` objects (with `replaceAll` off, like a REST PATCH)
+    and `cust*` fields go to the `customFieldList`. A payload holding a field the SOAP record
+    doesn't have, or a value whose SOAP type differs from REST (e.g. country codes, which
+    are enumerations in SOAP), raises `UnsupportedSoapPayloadError`.
+
+    Requests take a slot of the governor shared with the REST client, so both count against
+    the same account concurrency limit.
+    """
+
+    # NetSuite accepts up to 200 records per list operation, fewer during peak hours
+    default_batch_size = 100
+    custom_field_prefixes = ("custentity", "custbody", "custcol", "custrecord", "custitem", "custevent")
+    # faults NetSuite returns when the account concurrency or request limit is reached, netsuitesdk raises
+    # NetSuiteRateLimitError for the concurrency one ("SuiteTalk concurrent request limit exceeded")
+    throttling_faults = (
+        "ExceededConcurrentRequestLimitFault", "ExceededRequestLimitFault", "WS_CONCUR_SESSION_DISALLWD",
+        "concurrent request limit exceeded"
+    )
+    simple_types = {"string", "boolean", "double", "float", "decimal", "long", "int", "dateTime"}
+    date_only = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+    def __init__(self, config: dict, logger, governor: RequestGovernor, max_retries: int) -> None:
+        self.config = config
+        self.logger = logger
+        self.governor = governor
+        self.max_retries = max_retries
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The netsuitesdk client, the WSDL is loaded and the passport built on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    connection = NetSuiteConnection(
+                        account=self.config["ns_account"],
+                        consumer_key=self.config["ns_consumer_key"],
+                        consumer_secret=self.config["ns_consumer_secret"],
+                        token_key=self.config["ns_token_key"],
+                        token_secret=self.config["ns_token_secret"]
+                    )
+                    self._client = connection.client
+        return self._client
+
+    @property
+    def batch_size(self) -> int:
+        return max(int(self.config.get("soap_batch_size") or self.default_batch_size), 1)
+
+    def write_records(self, writes: List[tuple], upsert: bool = True) -> List[Optional[tuple]]:
+        """Creates or updates records with `updateList`, `upsertList` and `addList`
+
+        `writes` are `(soap_record_type, record_id, record)` tuples. Records with an id are
+        updated, new records with an externalId are upserted (keyed by externalId, so a retried
+        batch doesn't create duplicates) and the others are added. With `upsert` off every new
+        record is added, so a record whose externalId already exists fails instead of being
+        overwritten. Returns a
+        `(record_id, success, error_message)` tuple per write, in the order of `writes`, or
+        None for the writes whose payload can't be sent over SOAP.
+        """
+        results = [None] * len(writes)
+        operations = {}
+        for index, (soap_record_type, record_id, record) in enumerate(writes):
+            try:
+                soap_record = self.build_record(soap_record_type, record, record_id)
+            except UnsupportedSoapPayloadError as e:
+                self.logger.info(f"Writing {soap_record_type} {record_id or record.get('externalId') or ''} over REST: {e}")
+                continue
+
+            if record_id:
+                operation = "updateList"
+            elif upsert and record.get("externalId"):
+                operation = "upsertList"
+            else:
+                operation = "addList"
+            operations.setdefault(operation, []).append((index, soap_record))
+
+        for operation, soap_records in operations.items():
+            for start in range(0, len(soap_records), self.batch_size):
+                chunk = soap_records[start:start + self.batch_size]
+                for (index, _), result in zip(chunk, self._write_list(operation, [soap_record for _, soap_record in chunk])):
+                    record_id, success, error_message = result
+                    results[index] = (record_id or writes[index][1], success, error_message)
+
+        return results
+
+    def build_record(self, soap_record_type: str, record: dict, record_id=None):
+        record_type = getattr(self.client, soap_record_type, None)
+        if record_type is None:
+            raise UnsupportedSoapPayloadError(f"netsuitesdk has no {soap_record_type} type")
+
+        fields = self._build_fields(record_type, {key: value for key, value in record.items() if key != "internalId"}, soap_record_type)
+        if record_id:
+            fields["internalId"] = str(record_id)
+        return record_type(**fields)
+
+    def _build_fields(self, soap_type, payload: dict, path: str) -> dict:
+        elements = dict(soap_type.elements)
+        attributes = {name for name, _ in soap_type.attributes}
+        fields = {}
+        custom_fields = []
+        for key, value in payload.items():
+            if value is None:
+                continue
+            if key in attributes:
+                fields[key] = str(value)
+            elif key.startswith(self.custom_field_prefixes) and "customFieldList" in elements:
+                custom_fields.append(self._build_custom_field(key, value, f"{path}.{key}"))
+            else:
+                element = elements.get(key) or self._find_element(elements, key)
+                if element is None:
+                    raise UnsupportedSoapPayloadError(f"{path} has no field {key}")
+                fields[element.name] = self._build_value(element, value, f"{path}.{key}")
+
+        if custom_fields:
+            custom_field_list = elements["customFieldList"].type
+            fields["customFieldList"] = custom_field_list(customField=custom_fields)
+        return fields
+
+    @staticmethod
+    def _find_element(elements: dict, key: str):
+        # REST lower cases some fields (addressbookaddress for addressbookAddress) and drops
+        # the List suffix of sublists (addressbook for addressbookList, line for lineList)
+        names = {key.lower(), f"{key}List".lower()}
+        return next((element for name, element in elements.items() if name.lower() in names), None)
+
+    def _build_value(self, element, value, path: str):
+        soap_type = element.type
+        type_name = soap_type.name
+
+        if type_name == "RecordRef":
+            if not isinstance(value, dict) or not value.get("id"):
+                raise UnsupportedSoapPayloadError(f"{path} isn't a reference")
+            return soap_type(internalId=str(value["id"]))
+
+        if type_name in self.simple_types:
+            if isinstance(value, (dict, list)):
+                raise UnsupportedSoapPayloadError(f"{path} isn't a {type_name}")
+            if type_name == "dateTime" and isinstance(value, str) and self.date_only.match(value):
+                return f"{value}T00:00:00"
+            return value
+
+        if not hasattr(soap_type, "elements"):
+            # enumerations hold SOAP specific values (e.g. _unitedStates for the US country code)
+            raise UnsupportedSoapPayloadError(f"{path} is a {type_name} enumeration")
+        if not isinstance(value, dict):
+            raise UnsupportedSoapPayloadError(f"{path} isn't an object")
+
+        if "items" in value and type_name.endswith("List"):
+            # a sublist, e.g. {"items": [...]} -> CustomerAddressbookList(addressbook=[...], replaceAll=False)
+            if len(soap_type.elements) != 1:
+                raise UnsupportedSoapPayloadError(f"{path} isn't a sublist")
+            (item_name, item_element), = soap_type.elements
+            items = [
+                item_element.type(**self._build_fields(item_element.type, item, f"{path}[{position}]"))
+                for position, item in enumerate(value["items"])
+            ]
+            return soap_type(**{item_name: items, "replaceAll": False})
+
+        return soap_type(**self._build_fields(soap_type, value, path))
+
+    def _build_custom_field(self, script_id: str, value, path: str):
+        if isinstance(value, bool):
+            type_name, value = "BooleanCustomFieldRef", value
+        elif isinstance(value, int):
+            type_name, value = "LongCustomFieldRef", value
+        elif isinstance(value, float):
+            type_name, value = "DoubleCustomFieldRef", value
+        elif isinstance(value, dict) and value.get("id"):
+            type_name, value = "SelectCustomFieldRef", self._list_or_record_ref(value, path)
+        elif isinstance(value, list) and all(isinstance(item, dict) and item.get("id") for item in value):
+            type_name, value = "MultiSelectCustomFieldRef", [self._list_or_record_ref(item, path) for item in value]
+        elif isinstance(value, str) and not self.date_only.match(value):
+            type_name, value = "StringCustomFieldRef", value
+        else:
+            # dates are parsed by REST according to the field type, SOAP needs the type up front
+            raise UnsupportedSoapPayloadError(f"{path} has no SOAP custom field type")
+
+        custom_field_type = getattr(self.client, type_name, None)
+        if custom_field_type is None:
+            raise UnsupportedSoapPayloadError(f"netsuitesdk has no {type_name} type")
+        return custom_field_type(scriptId=script_id, value=value)
+
+    def _list_or_record_ref(self, value: dict, path: str):
+        list_or_record_ref = getattr(self.client, "ListOrRecordRef", None)
+        if list_or_record_ref is None:
+            raise UnsupportedSoapPayloadError(f"netsuitesdk has no ListOrRecordRef type for {path}")
+        return list_or_record_ref(internalId=str(value["id"]))
+
+    def _write_list(self, operation: str, soap_records: list) -> List[tuple]:
+        endpoint = f"soap/{operation}"
+        attempt = 0
+        while True:
+            throttled = False
+            with self.governor.slot(endpoint):
+                try:
+                    response = self.client.request(operation, record=soap_records)
+                except Exception as e:
+                    if attempt >= self.max_retries or not self._is_throttled(e):
+                        return [(None, False, f"{operation} failed: {e}")] * len(soap_records)
+                    throttled = True
+
+            if not throttled:
+                return self._write_results(response, len(soap_records))
+
+            self.governor.record(endpoint, throttled=1, retries=1)
+            delay = self.governor.backoff(attempt)
+            self.logger.warning(f"NetSuite throttled {operation}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def _is_throttled(self, error: Exception) -> bool:
+        if isinstance(error, NetSuiteRateLimitError):
+            return True
+        message = str(error)
+        return any(fault in message for fault in self.throttling_faults)
+
+    def _write_results(self, response, size: int) -> List[tuple]:
+        write_response_list = response.body.writeResponseList
+        write_responses = getattr(write_response_list, "writeResponse", None)
+        if not write_responses:
+            # the whole request was rejected, the list status holds the reason
+            error_message = self._status_message(getattr(write_response_list, "status", None))
+            return [(None, False, error_message)] * size
+
+        results = []
+        for write_response in write_responses:
+            base_ref = getattr(write_response, "baseRef", None)
+            record_id = getattr(base_ref, "internalId", None)
+            if write_response.status.isSuccess:
+                results.append((record_id, True, None))
+            else:
+                results.append((record_id, False, self._status_message(write_response.status)))
+        return results
+
+    @staticmethod
+    def _status_message(status) -> str:
+        details = getattr(status, "statusDetail", None) or []
+        messages = [f"{getattr(detail, 'code', '')}: {getattr(detail, 'message', '')}" for detail in details]
+        return "; ".join(messages) or "NetSuite rejected the request"
@@ -0,0 +1,128 @@
+import codecs
+import json
+
+from typing import Callable, Optional
+
+
+class SuiteQLPageDecoder:
+    """Incremental decoder of a SuiteQL response page
+
+    The body is fed in chunks as it is read from the socket. Rows of the `items` array are
+    decoded one at a time and built by `row_hook` from their `(key, value)` pairs, which
+    renames their keys (SuiteQL returns every column in lower case) or builds compact rows,
+    so neither the whole body nor a second copy of the rows is held in memory. The other
+    top level fields (`hasMore`, `totalResults`, ...) are kept as is.
+    """
+
+    _whitespace = " \t\n\r"
+    # returned by `_decode` when the value continues in the next chunk, a decoded value may be None
+    _incomplete = object()
+
+    def __init__(self, row_hook: Optional[Callable[[list], object]] = None) -> None:
+        self.page = {}
+        self.rows = []
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        if row_hook:
+            self._row_decoder = json.JSONDecoder(object_pairs_hook=row_hook)
+        else:
+            self._row_decoder = self._decoder
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+
+    def feed(self, data: bytes) -> None:
+        self._buffer = self._buffer[self._pos:] + self._text_decoder.decode(data)
+        self._pos = 0
+        self._parse(final=False)
+
+    def close(self) -> dict:
+        self._buffer = self._buffer[self._pos:] + self._text_decoder.decode(b"", final=True)
+        self._pos = 0
+        self._parse(final=True)
+        if self._state != "done":
+            raise ValueError("Truncated SuiteQL response")
+
+        self.page["items"] = self.rows
+        return self.page
+
+    def _parse(self, final: bool) -> None:
+        while self._state != "done":
+            self._skip(self._whitespace + ("," if self._state != "start" else ""))
+            if self._pos >= len(self._buffer):
+                return
+
+            char = self._buffer[self._pos]
+            if self._state == "start":
+                if char != "{":
+                    raise ValueError("SuiteQL response isn't a JSON object")
+                self._pos += 1
+                self._state = "key"
+            elif self._state == "key":
+                if char == "}":
+                    self._pos += 1
+                    self._state = "done"
+                    continue
+                if not self._parse_field(final):
+                    return
+            elif self._state == "items":
+                if char == "]":
+                    self._pos += 1
+                    self._state = "key"
+                    continue
+                row = self._decode(self._row_decoder, final)
+                if row is self._incomplete:
+                    return
+                self.rows.append(row)
+
+    def _parse_field(self, final: bool) -> bool:
+        start = self._pos
+        key = self._decode(self._decoder, final)
+        if key is self._incomplete:
+            return False
+
+        self._skip(self._whitespace)
+        if self._pos >= len(self._buffer):
+            self._pos = start
+            return False
+        if self._buffer[self._pos] != ":":
+            raise ValueError("Invalid SuiteQL response")
+        self._pos += 1
+
+        self._skip(self._whitespace)
+        if self._pos >= len(self._buffer):
+            self._pos = start
+            return False
+
+        if key == "items" and self._buffer[self._pos] == "[":
+            self._pos += 1
+            self._state = "items"
+            return True
+
+        value = self._decode(self._decoder, final)
+        if value is self._incomplete:
+            self._pos = start
+            return False
+        self.page[key] = value
+        return True
+
+    def _decode(self, decoder: json.JSONDecoder, final: bool):
+        """Decodes the value at the current position, `_incomplete` when more data is needed"""
+        try:
+            value, end = decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return self._incomplete
+        # a number or literal at the end of the buffer may continue in the next chunk
+        if end >= len(self._buffer) and not final:
+            return self._incomplete
+        self._pos = end
+        return value
+
+    def _skip(self, characters: str) -> None:
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer) and buffer[pos] in characters:
+            pos += 1
+        self._pos = pos
@@ -1,7 +1,9 @@
 import json
 import os
+import sqlite3
 
 from datetime import datetime
+from functools import partial
 from pathlib import PurePath
 from pendulum import parse
 from singer_sdk import typing as th
@@ -18,6 +20,9 @@ from target_netsuite_v2.sink.invoice_payment_sink import InvoicePaymentSink
 from target_netsuite_v2.sink.journal_entry_sink import JournalEntrySink
 from target_netsuite_v2.sink.purchase_order_sink import PurchaseOrderSink
 from target_netsuite_v2.suite_talk_client import SuiteTalkRestClient
+from target_netsuite_v2.reference_data import LazyReferenceData, ReferenceTableUnavailable, compact_rows
+from target_netsuite_v2.snapshot_store import SnapshotStore
+from target_netsuite_v2.entity_cache import EntityCache
 from typing import List, Optional, Union
 
 class TargetNetsuiteV2(TargetHotglue):
@@ -32,6 +37,38 @@ class TargetNetsuiteV2(TargetHotglue):
         th.Property("ns_account", th.StringType)
     ).to_dict()
 
+    # Optional settings forwarded to the SuiteTalk client to tune the HTTP transport
+    NS_CLIENT_TUNING_KEYS = [
+        "pool_maxsize",
+        "connect_timeout",
+        "request_timeout",
+        "ns_concurrency_limit",
+        "max_retries",
+        "retry_backoff_base",
+        "retry_backoff_max",
+        "suiteql_max_query_length",
+        "max_rows_per_query",
+        "suiteql_cache_ttl",
+        "suiteql_cache_ttls",
+        "async_poll_interval",
+        "async_poll_max_interval",
+        "async_job_timeout",
+        "soap_batch_size"
+    ]
+
+    # Reference tables shared by every stream, keyed by their name in the reference data
+    GLOBAL_REFERENCE_TABLES = {
+        "Subsidiaries": "subsidiary",
+        "Classifications": "classification",
+        "Currencies": "currency",
+        "Departments": "department",
+        "Locations": "location",
+        "Accounts": "account",
+        "CustomerCategory": "customercategory",
+        "VendorCategory": "vendorcategory",
+        "Taxes": "salestaxitem"
+    }
+
     SINK_TYPES = [
         VendorSink,
         VendorCreditSink,
@@ -56,6 +93,7 @@ class TargetNetsuiteV2(TargetHotglue):
         self.config_file = config[0]
         super().__init__(config, parse_env_config, validate_config)
         self.suite_talk_client = self.get_ns_client()
+        self.entity_cache = EntityCache(int(self.config.get("entity_cache_size", 50000)))
         self.reference_data = self.get_reference_data()
 
     def get_ns_client(self):
@@ -66,60 +104,223 @@ class TargetNetsuiteV2(TargetHotglue):
             "ns_token_secret": self.config["ns_token_secret"],
             "ns_account": self.config["ns_account"]
         }
+        for key in self.NS_CLIENT_TUNING_KEYS:
+            if self.config.get(key) is not None:
+                netsuite_config[key] = self.config[key]
+        if self.config.get("suiteql_cache_ttl"):
+            netsuite_config["suiteql_cache_path"] = self.config.get("suiteql_cache_path") or f'{self.config.get("snapshot_dir", "snapshots")}/suiteql_cache.sqlite'
         return SuiteTalkRestClient(netsuite_config, self.logger)
 
-    def get_reference_data(self):
-        if self.config.get("snapshot_hours"):
+    def _process_endofpipe(self) -> None:
+        super()._process_endofpipe()
+        self.write_reference_data_snapshot()
+        self.suite_talk_client.close()
+
+    def add_sink(self, stream_name: str, schema: dict, key_properties: Optional[List[str]] = None):
+        sink = super().add_sink(stream_name, schema, key_properties)
+        # Start loading the global tables the stream needs as soon as its SCHEMA message arrives
+        self.reference_data.prefetch(getattr(sink, "global_reference_tables", []))
+        return sink
+
+    def drain_one(self, sink) -> None:
+        """Drains a sink, after the upstream sinks still holding records
+
+        A full Bills batch is drained while the Vendors batch it references may still be
+        pending, so the pending vendors are written first. Created entities reach the
+        downstream lookups through the entity cache.
+        """
+        self._drain_upstream_sinks(sink, {id(sink)})
+        super().drain_one(sink)
+
+    def _drain_upstream_sinks(self, sink, visiting: set) -> None:
+        for upstream in self.upstream_sinks(sink):
+            # a dependency cycle is drained in the order it is met
+            if upstream.current_size and id(upstream) not in visiting:
+                self._drain_upstream_sinks(upstream, visiting | {id(upstream)})
+                super().drain_one(upstream)
+
+    def _drain_all(self, sink_list: list, parallelism: int) -> None:
+        """Drains the sinks level by level, the independent sinks of a level are drained concurrently"""
+        for level in self.drain_levels(sink_list):
+            super()._drain_all(level, parallelism)
+
+    def upstream_sinks(self, sink) -> list:
+        upstream_streams = getattr(sink, "upstream_streams", [])
+        return [other for other in self._sinks_active.values() if other is not sink and other.name in upstream_streams]
+
+    def drain_levels(self, sink_list: list) -> list:
+        """Groups sinks by dependency level, a sink comes after the sinks of `sink_list` it references"""
+        members = {id(sink) for sink in sink_list}
+        levels = {}
+
+        def level_of(sink, visiting: tuple) -> int:
+            if id(sink) not in levels:
+                upstreams = [
+                    upstream for upstream in self.upstream_sinks(sink)
+                    if id(upstream) in members and id(upstream) not in visiting
+                ]
+                levels[id(sink)] = 1 + max((level_of(upstream, (*visiting, id(upstream))) for upstream in upstreams), default=-1)
+            return levels[id(sink)]
+
+        grouped = {}
+        for sink in sink_list:
+            grouped.setdefault(level_of(sink, (id(sink),)), []).append(sink)
+        return [grouped[level] for level in sorted(grouped)]
+
+    @property
+    def snapshot_format(self) -> str:
+        return self.config.get("snapshot_format", "json")
+
+    @property
+    def snapshot_path(self) -> str:
+        extension = "sqlite" if self.snapshot_format == "sqlite" else "json"
+        return f'{self.config.get("snapshot_dir", "snapshots")}/reference_data.{extension}'
+
+    def read_reference_data_snapshot(self) -> dict:
+        if not self.config.get("snapshot_hours"):
+            return {}
+        if self.snapshot_format == "sqlite":
             try:
-                with open(f'{self.config.get("snapshot_dir", "snapshots")}/reference_data.json') as json_file:
-                    reference_data = json.load(json_file)
-                    if reference_data.get("write_date"):
-                        last_run = parse(reference_data["write_date"])
-                        last_run = last_run.replace(tzinfo=None)
-                        if (datetime.utcnow()-last_run).total_hours()<int(self.config.get("snapshot_hours")):
-                            return reference_data
-            except:
+                return SnapshotStore(self.snapshot_path)
+            except sqlite3.Error:
                 self.logger.info(f"Snapshot not found or not readable.")
+                return {}
+        try:
+            with open(self.snapshot_path) as json_file:
+                return json.load(json_file)
+        except:
+            self.logger.info(f"Snapshot not found or not readable.")
+            return {}
 
-        self.logger.info(f"Reading data from API...")
-        reference_data = {}
+    def is_snapshot_fresh(self, fetched_at: Optional[str]) -> bool:
+        if not fetched_at:
+            return False
+        last_run = parse(fetched_at).replace(tzinfo=None)
+        return (datetime.utcnow() - last_run).total_seconds() < float(self.config["snapshot_hours"]) * 3600
 
-        _, _, subsidiaries = self.suite_talk_client.get_reference_data("subsidiary", allow_empty_filters=True)
-        reference_data["Subsidiaries"] = subsidiaries
+    def get_reference_data(self):
+        """Global reference data, each table is fetched the first time a stream needs it
+
+        Tables in the snapshot fetched less than `snapshot_hours` ago are reused as is, they are
+        read from the snapshot the first time a stream needs them too.
+        """
+        self.reference_snapshot = self.read_reference_data_snapshot()
+        self.reference_data_fetched_at = {}
+        self.reference_data_watermarks = {}
+
+        loaders = {}
+        tables_fetched_at = self.reference_snapshot.get("tables_fetched_at", {})
+        for name, record_type in self.GLOBAL_REFERENCE_TABLES.items():
+            fetched_at = tables_fetched_at.get(name) or self.reference_snapshot.get("write_date")
+            if name in self.reference_snapshot and self.is_snapshot_fresh(fetched_at):
+                loaders[name] = partial(self.load_snapshot_table, name)
+            else:
+                loaders[name] = partial(self.fetch_reference_table, name, record_type)
+
+        return LazyReferenceData(loaders)
+
+    def load_snapshot_table(self, name: str) -> list:
+        if isinstance(self.reference_snapshot, SnapshotStore):
+            # rows are compacted as they are decoded, the decoded table isn't kept
+            return compact_rows(self.reference_snapshot.iter_rows(name))
+        return compact_rows(self.reference_snapshot[name])
+
+    def fetch_reference_table(self, name: str, record_type: str) -> list:
+        fetched_at = datetime.utcnow().isoformat()
+        incremental = bool(self.config.get("snapshot_hours") and self.config.get("snapshot_incremental"))
+        watermark = self.reference_snapshot.get("watermarks", {}).get(name)
+
+        rows = None
+        if incremental and watermark and name in self.reference_snapshot:
+            rows = self.refresh_reference_table(name, record_type, self.reference_snapshot[name], watermark)
+
+        if rows is None:
+            self.logger.info(f"Reading {name} from API...")
+            success, error_message, rows = self.suite_talk_client.get_reference_data(
+                record_type, allow_empty_filters=True, with_last_modified=incremental, compact_rows=True
+            )
+            if not success:
+                # not recorded as fetched nor memoized, so a failed read never replaces the snapshot and is retried
+                self.logger.warning(f"Could not read {name} from API: {error_message}")
+                raise ReferenceTableUnavailable(error_message, compact_rows(self.reference_snapshot.get(name) or []))
 
-        _, _, classifications = self.suite_talk_client.get_reference_data("classification", allow_empty_filters=True)
-        reference_data["Classifications"] = classifications
+        self.reference_data_fetched_at[name] = fetched_at
+        last_modified = max((row["lastModified"] for row in rows if row.get("lastModified")), default=watermark)
+        if last_modified:
+            self.reference_data_watermarks[name] = last_modified
 
-        _, _, currencies = self.suite_talk_client.get_reference_data("currency", allow_empty_filters=True)
-        reference_data["Currencies"] = currencies
+        return rows
 
-        _, _, departments = self.suite_talk_client.get_reference_data("department", allow_empty_filters=True)
-        reference_data["Departments"] = departments
+    def refresh_reference_table(self, name: str, record_type: str, rows: list, watermark: str) -> Optional[list]:
+        """Merges the rows changed since `watermark` into the snapshot rows of a table
 
-        _, _, locations = self.suite_talk_client.get_reference_data("location", allow_empty_filters=True)
-        reference_data["Locations"] = locations
+        Deleted rows are dropped after an id only sweep of the table. Returns None when the
+        table can't be refreshed incrementally so it is fetched in full.
+        """
+        if record_type not in self.suite_talk_client.ref_last_modified_fields:
+            return None
 
-        _, _, accounts = self.suite_talk_client.get_reference_data("account", allow_empty_filters=True)
-        reference_data["Accounts"] = accounts
+        self.logger.info(f"Refreshing {name} changed since {watermark} from API...")
+        success, _, changed_rows = self.suite_talk_client.get_reference_data(
+            record_type, modified_since=watermark, with_last_modified=True, compact_rows=True
+        )
+        if not success:
+            return None
 
-        _, _, customer_categories = self.suite_talk_client.get_reference_data("customercategory", allow_empty_filters=True)
-        reference_data["CustomerCategory"] = customer_categories
+        success, _, existing_ids = self.suite_talk_client.get_reference_ids(record_type)
+        if not success:
+            return None
 
-        _, _, vendor_categories = self.suite_talk_client.get_reference_data("vendorcategory", allow_empty_filters=True)
-        reference_data["VendorCategory"] = vendor_categories
+        changed_by_id = {str(row["internalId"]): row for row in changed_rows}
+        merged = [
+            changed_by_id.pop(str(row["internalId"]), row)
+            for row in compact_rows(rows)
+            if str(row["internalId"]) in existing_ids
+        ]
+        merged.extend(changed_by_id.values())
 
-        _, _, tax_codes = self.suite_talk_client.get_reference_data("salestaxitem", allow_empty_filters=True)
-        reference_data["Taxes"] = tax_codes
+        self.logger.info(f"Refreshed {name}: {len(changed_rows)} changed, {len(rows) + len(changed_by_id) - len(merged)} removed")
+        return merged
 
-        # Batch specific reference data is not currently being written to the snapshot since it is not fetched here
-        # But is instead lazily fetched per batch
-        if self.config.get("snapshot_hours"):
-            reference_data["write_date"] = datetime.utcnow().isoformat()
-            os.makedirs("snapshots", exist_ok=True)
-            with open('snapshots/reference_data.json', 'w') as outfile:
-                json.dump(reference_data, outfile)
+    def write_reference_data_snapshot(self):
+        # Only the global tables are written to the snapshot,
+        # batch specific reference data is lazily fetched per batch
+        if not self.config.get("snapshot_hours") or not self.reference_data_fetched_at:
+            return
+
+        tables_fetched_at = {
+            name: self.reference_snapshot.get("tables_fetched_at", {}).get(name) or self.reference_snapshot.get("write_date")
+            for name in self.GLOBAL_REFERENCE_TABLES
+            if name in self.reference_snapshot
+        }
+        tables_fetched_at.update(self.reference_data_fetched_at)
+
+        tables = {name: self.reference_data[name] for name in self.reference_data_fetched_at}
+        meta = {
+            "write_date": datetime.utcnow().isoformat(),
+            "tables_fetched_at": tables_fetched_at,
+            "watermarks": {
+                **self.reference_snapshot.get("watermarks", {}),
+                **self.reference_data_watermarks
+            }
+        }
+
+        if self.snapshot_format == "sqlite":
+            store = self.reference_snapshot if isinstance(self.reference_snapshot, SnapshotStore) else SnapshotStore(self.snapshot_path)
+            store.write(tables, meta)
+            return
+
+        snapshot = {
+            name: rows
+            for name, rows in self.reference_snapshot.items()
+            if name in self.GLOBAL_REFERENCE_TABLES
+        }
+        snapshot.update({name: [dict(row) for row in rows] for name, rows in tables.items()})
+        snapshot.update(meta)
 
-        return reference_data
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        with open(self.snapshot_path, 'w') as outfile:
+            json.dump(snapshot, outfile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+import io
+import json
+import logging
+import time
+
+import requests
+
+from target_netsuite_v2.entity_cache import EntityCache
+from target_netsuite_v2.query_cache import QueryCache
+from target_netsuite_v2.suite_talk_client import SuiteTalkRestClient
+
+
+def test_query_cache_returns_fresh_entries_only(tmp_path):
+    cache = QueryCache(str(tmp_path / "suiteql.sqlite"), ttl=60, ttls={"vendor": 0})
+    rows = [{"internalId": "1", "externalId": "v-1"}]
+
+    cache.put_many("customer", "columns", "externalId", {"v-1": rows})
+    cache.put_many("vendor", "columns", "externalId", {"v-1": rows})
+
+    assert cache.get_many("customer", "columns", "externalId", ["v-1", "v-2"]) == {"v-1": rows}
+    assert cache.get_many("customer", "other columns", "externalId", ["v-1"]) == {}
+    assert cache.get_many("vendor", "columns", "externalId", ["v-1"]) == {}
+
+    cache.ttl = 0.01
+    time.sleep(0.02)
+    assert cache.get_many("customer", "columns", "externalId", ["v-1"]) == {}
+
+
+def test_query_cache_drops_the_entries_of_written_records(tmp_path):
+    cache = QueryCache(str(tmp_path / "suiteql.sqlite"), ttl=60)
+    cache.put_many("customer", "columns", "name", {"Acme": [{"internalId": "1"}, {"internalId": "2"}], "Other": [{"internalId": "3"}]})
+    cache.put_many("customer", "columns", "externalId", {"c-4": [{"internalId": "4"}]})
+
+    cache.invalidate(internal_ids=["2"])
+    assert cache.get_many("customer", "columns", "name", ["Acme", "Other"]) == {"Other": [{"internalId": "3"}]}
+
+    cache.invalidate(keys=["c-4"])
+    assert cache.get_many("customer", "columns", "externalId", ["c-4"]) == {}
+
+
+def test_client_writes_invalidate_the_query_cache(tmp_path):
+    client = SuiteTalkRestClient(
+        {
+            "ns_account": "TSTDRV1", "ns_consumer_key": "key", "ns_consumer_secret": "secret",
+            "ns_token_key": "token", "ns_token_secret": "secret",
+            "suiteql_cache_path": str(tmp_path / "suiteql.sqlite"), "suiteql_cache_ttl": 60
+        },
+        logging.getLogger("test")
+    )
+    response = requests.Response()
+    response.status_code = 204
+    response.raw = io.BytesIO(b"")
+    client._session = type("Session", (), {"request": lambda self, **kwargs: response})()
+
+    client.query_cache.put_many("customer", "columns", "internalId", {"7": [{"internalId": "7"}]})
+    client.query_cache.put_many("customer", "columns", "externalId", {"c-8": [{"internalId": "8"}]})
+
+    client.update_record("customer", "7", {"companyName": "Acme"})
+    client.update_record("customer", "9", {"externalId": "c-8"})
+
+    assert client.query_cache.get_many("customer", "columns", "internalId", ["7"]) == {}
+    assert client.query_cache.get_many("customer", "columns", "externalId", ["c-8"]) == {}
+
+
+def test_entity_cache_index_stays_bounded_on_eviction():
+    cache = EntityCache(max_size=3)
+
+    for internal_id in range(10):
+        cache.put("vendor", [{"internalId": str(internal_id), "externalId": f"v-{internal_id}"}])
+
+    assert len(cache._entries) == 3
+    assert set(cache._keys_by_internal_id) == {("vendor", "8"), ("vendor", "9")}
+    assert cache.get("vendor", "externalId", "v-9") == [{"internalId": "9", "externalId": "v-9"}]
+
+
+def test_entity_cache_adds_created_rows_to_their_name_entry():
+    cache = EntityCache()
+    existing = [{"internalId": "1", "name": "Acme"}, {"internalId": "2", "name": "Acme"}]
+    cache.put("customer", existing, names={"Acme"})
+
+    cache.add("customer", {"internalId": "3", "name": "Acme"})
+
+    assert [row["internalId"] for row in cache.get("customer", "name", "Acme")] == ["1", "2", "3"]
+
+
+def test_entity_cache_invalidation_drops_every_entry_of_the_record():
+    cache = EntityCache()
+    cache.put("customer", [{"internalId": "1", "externalId": "c-1", "entityId": "C1", "name": "Acme"}, {"internalId": "2", "name": "Acme"}], names={"Acme"})
+
+    cache.invalidate("customer", 1)
+
+    assert cache.get("customer", "internalId", "1") is None
+    assert cache.get("customer", "externalId", "c-1") is None
+    assert cache.get("customer", "name", "Acme") is None
+    assert cache.get("customer", "internalId", "2") == [{"internalId": "2", "name": "Acme"}]
+    assert ("customer", "1") not in cache._keys_by_internal_id
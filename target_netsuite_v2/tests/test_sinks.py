@@ -0,0 +1,171 @@
+import threading
+
+from target_netsuite_v2.sinks import NetSuiteBatchSink
+
+
+class StubSink(NetSuiteBatchSink):
+    def preprocess_batch_record(self, record: dict, reference_data: dict) -> dict:
+        return dict(record)
+
+
+class InvoiceLikeSink(StubSink):
+    name = "Invoices"
+    record_extra_pk_mappings = [{"record_field": "invoiceNumber", "netsuite_field": "tranId"}]
+
+
+class CustomerLikeSink(StubSink):
+    name = "Customers"
+    record_extra_pk_mappings = [{"record_field": "customerNumber", "netsuite_field": "entityId"}]
+    parent_reference_fields = {"parentId": "id", "parentNumber": "customerNumber"}
+
+
+def make_sink(sink_class):
+    # the sink isn't attached to a target, only the state the tested methods read is set
+    sink = sink_class.__new__(sink_class)
+    sink._reference_data_lock = threading.RLock()
+    return sink
+
+
+def group_indexes(sink, records: list) -> list:
+    return [[index for index, _ in group] for group in sink._group_records(records)]
+
+
+def test_records_sharing_an_extra_primary_key_are_grouped_in_batch_order():
+    records = [
+        {"invoiceNumber": "INV-1", "externalId": "a"},
+        {"invoiceNumber": "INV-2"},
+        {"invoiceNumber": "INV-1", "externalId": "b"},
+        {"invoiceNumber": "INV-1"}
+    ]
+
+    assert group_indexes(make_sink(InvoiceLikeSink), records) == [[0, 2, 3], [1]]
+
+
+def test_records_sharing_an_id_or_external_id_are_grouped():
+    records = [{"externalId": "a"}, {"id": "7"}, {"externalId": "a", "memo": "second"}, {"id": "7", "memo": "second"}]
+
+    assert group_indexes(make_sink(InvoiceLikeSink), records) == [[0, 2], [1, 3]]
+
+
+def test_child_is_grouped_after_its_parent():
+    records = [
+        {"externalId": "child", "parentNumber": "P-1"},
+        {"externalId": "other"},
+        {"externalId": "parent", "customerNumber": "P-1"},
+        {"externalId": "grandchild", "parentId": "child-id"},
+        {"id": "child-id", "externalId": "child-2", "parentNumber": "P-1"}
+    ]
+
+    assert group_indexes(make_sink(CustomerLikeSink), records) == [[1], [2, 0, 4, 3]]
+
+
+def test_reference_cycles_keep_the_batch_order():
+    records = [
+        {"externalId": "a", "customerNumber": "A", "parentNumber": "B"},
+        {"externalId": "b", "customerNumber": "B", "parentNumber": "A"}
+    ]
+
+    assert group_indexes(make_sink(CustomerLikeSink), records) == [[0, 1]]
+
+
+def test_rounds_write_one_record_per_group():
+    sink = make_sink(InvoiceLikeSink)
+    records = [{"invoiceNumber": "INV-1"}, {"invoiceNumber": "INV-2"}, {"invoiceNumber": "INV-1", "memo": "update"}]
+    rounds = []
+
+    def write_records(round_records):
+        rounds.append(round_records)
+        return [(None, False, "not written") for _ in round_records]
+
+    sink.prepare_batch_record = lambda record, reference_data: (dict(record), None)
+    sink.record_exists = lambda record: False
+    sink.apply_write_result = lambda *args, **kwargs: {"error": "not written"}
+    sink.complete_batch_record_state = lambda record, preprocessed, id, success, state: (state, {"record": record})
+    sink.update_state = lambda state, **kwargs: None
+
+    sink.process_batch_records_in_rounds(records, {}, write_records)
+
+    assert rounds == [[records[0], records[1]], [records[2]]]
+
+
+def test_created_parent_is_found_by_name_and_number():
+    from target_netsuite_v2.mapper.customer_schema_mapper import CustomerSchemaMapper
+
+    sink = make_sink(CustomerLikeSink)
+    sink.entity_name_field = "companyName"
+    sink.entity_cache_record_type = None
+    reference_data = {"Customers": [], "Addresses": {}}
+
+    sink.apply_write_result({"companyName": "Acme", "entityId": "P-1", "externalId": "parent"}, reference_data, "10", None, False)
+
+    for child in ({"parentName": "Acme"}, {"parentNumber": "P-1"}):
+        mapper = CustomerSchemaMapper(child, "Customers", reference_data)
+        assert mapper._map_subrecord("Customers", "parentId", "parentName", "parent", entity_id_field="parentNumber") == {"parent": {"id": "10"}}
+
+
+def test_updated_and_upserted_records_are_dropped_from_the_entity_cache():
+    from types import SimpleNamespace
+    from target_netsuite_v2.entity_cache import EntityCache
+
+    sink = make_sink(CustomerLikeSink)
+    sink.entity_cache_record_type = "customer"
+    sink.entity_name_field = "companyName"
+    sink._target = SimpleNamespace(entity_cache=EntityCache())
+    cache = sink._target.entity_cache
+    cache.put("customer", [{"internalId": "1", "externalId": "c-1"}, {"internalId": "2", "externalId": "c-2"}])
+    reference_data = {"Customers": [], "Addresses": {}}
+
+    state = sink.apply_write_result({"externalId": "c-1", "companyName": "Renamed"}, reference_data, "1", None, did_update=True)
+    assert state == {"is_updated": True}
+    assert cache.get("customer", "externalId", "c-1") is None
+
+    state = sink.apply_write_result({"externalId": "c-2", "companyName": "Upserted"}, reference_data, "2", None, did_update=False, upserted=True)
+    assert state == {}
+    assert cache.get("customer", "externalId", "c-2") is None
+    assert cache.get("customer", "name", "Upserted") is None
+    assert [row["internalId"] for row in reference_data["Customers"]] == ["2"]
+
+    sink.apply_write_result({"externalId": "c-3", "companyName": "Created"}, reference_data, "3", None, did_update=False)
+    assert [row["internalId"] for row in cache.get("customer", "name", "Created")] == ["3"]
+
+
+def test_pipeline_chunks_keep_groups_together():
+    sink = make_sink(InvoiceLikeSink)
+    sink._config = {"pipeline_chunk_size": 2}
+    records = [{"invoiceNumber": "INV-1"}, {"invoiceNumber": "INV-2"}, {"invoiceNumber": "INV-1", "memo": "update"}, {"invoiceNumber": "INV-3"}]
+
+    assert sink._pipeline_chunks(records) == [[records[0], records[2]], [records[1], records[3]]]
+
+
+def test_pipelined_chunks_see_the_rows_created_by_the_previous_chunks():
+    sink = make_sink(InvoiceLikeSink)
+    sink._config = {"pipeline_chunk_size": 1}
+    records = [{"invoiceNumber": "INV-1"}, {"invoiceNumber": "INV-2"}, {"invoiceNumber": "INV-3"}]
+    seen = []
+
+    # every lookup returns what NetSuite held before the batch, i.e. none of the invoices
+    sink._chunk_reference_data = lambda context, chunk: {"Invoices": [], "Addresses": {}}
+
+    def write_batch_records(chunk, reference_data):
+        seen.append([row["tranId"] for row in reference_data["Invoices"]])
+        for record in chunk:
+            internal_id = str(len(seen))
+            reference_data["Invoices"].append({"internalId": internal_id, "tranId": record["invoiceNumber"]})
+            reference_data["Addresses"][internal_id] = [{"addr1": record["invoiceNumber"]}]
+
+    sink.write_batch_records = write_batch_records
+
+    sink.process_batch_pipelined({}, records)
+
+    assert seen == [[], ["INV-1"], ["INV-1", "INV-2"]]
+
+
+def test_merging_created_rows_skips_the_rows_a_lookup_already_returned():
+    rows = [{"internalId": "1", "tranId": "INV-1"}]
+    addresses = {"1": ["looked up"]}
+    created_rows = {"1": {"internalId": "1", "tranId": "stale"}, "2": {"internalId": "2", "tranId": "INV-2"}}
+
+    NetSuiteBatchSink._merge_created_rows(rows, addresses, created_rows, {"1": ["created"], "2": ["created"]})
+
+    assert rows == [{"internalId": "1", "tranId": "INV-1"}, {"internalId": "2", "tranId": "INV-2"}]
+    assert addresses == {"1": ["looked up"], "2": ["created"]}
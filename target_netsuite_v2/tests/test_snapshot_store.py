@@ -0,0 +1,54 @@
+import sqlite3
+
+from target_netsuite_v2.reference_data import compact_rows
+from target_netsuite_v2.snapshot_store import SnapshotStore
+
+
+ACCOUNTS = [
+    {"internalId": "1", "externalId": "a-1", "name": "Cash", "number": "1000"},
+    {"internalId": "2", "externalId": None, "name": "Receivables", "number": "1100"},
+    {"internalId": "3", "externalId": "a-3", "name": "Cash", "number": "1200"}
+]
+
+
+def test_tables_and_metadata_are_read_back(tmp_path):
+    path = str(tmp_path / "snapshots" / "reference_data.sqlite")
+    SnapshotStore(path).write({"Accounts": compact_rows(ACCOUNTS)}, {"write_date": "2026-01-01T00:00:00"})
+
+    store = SnapshotStore(path)
+
+    assert "Accounts" in store
+    assert store["write_date"] == "2026-01-01T00:00:00"
+    assert list(store.iter_rows("Accounts")) == ACCOUNTS
+    assert store["Accounts"] == ACCOUNTS
+
+
+def test_rows_are_found_by_indexed_key(tmp_path):
+    path = str(tmp_path / "reference_data.sqlite")
+    SnapshotStore(path).write({"Accounts": ACCOUNTS}, {})
+
+    store = SnapshotStore(path)
+
+    assert store.find("Accounts", "internalId", 2) == [ACCOUNTS[1]]
+    assert store.find("Accounts", "externalId", "a-3") == [ACCOUNTS[2]]
+    assert store.find("Accounts", "name", "Cash") == [ACCOUNTS[0], ACCOUNTS[2]]
+    assert store.find("Accounts", "name", "Payables") == []
+    assert store.find("Vendors", "name", "Cash") == []
+    assert "Accounts" not in store._tables
+
+    with sqlite3.connect(path) as connection:
+        plan = connection.execute(
+            "EXPLAIN QUERY PLAN SELECT data FROM rows WHERE section = ? AND external_id = ?", ("Accounts", "a-3")
+        ).fetchall()
+    assert "rows_external_id" in str(plan)
+
+
+def test_writing_a_table_keeps_the_other_tables(tmp_path):
+    path = str(tmp_path / "reference_data.sqlite")
+    SnapshotStore(path).write({"Accounts": ACCOUNTS, "Currencies": [{"internalId": "1", "symbol": "USD"}]}, {})
+    SnapshotStore(path).write({"Accounts": ACCOUNTS[:1]}, {})
+
+    store = SnapshotStore(path)
+
+    assert store["Accounts"] == ACCOUNTS[:1]
+    assert store["Currencies"] == [{"internalId": "1", "symbol": "USD"}]
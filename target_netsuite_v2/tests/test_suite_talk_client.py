@@ -0,0 +1,234 @@
+import io
+import json
+import logging
+import threading
+
+import requests
+
+from target_netsuite_v2.suite_talk_client import SuiteTalkRestClient
+
+
+CONFIG = {
+    "ns_account": "TSTDRV1",
+    "ns_consumer_key": "consumer_key",
+    "ns_consumer_secret": "consumer_secret",
+    "ns_token_key": "token_key",
+    "ns_token_secret": "token_secret",
+    "ns_concurrency_limit": 2,
+    "retry_backoff_base": 0,
+    "retry_backoff_max": 0
+}
+
+
+def make_response(status_code: int, body: dict = None, headers: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(json.dumps(body or {}).encode())
+    response.headers.update(headers or {})
+    response.request = requests.Request("POST", "https://example.com").prepare()
+    return response
+
+
+class FakeSession:
+    def __init__(self, responses: list) -> None:
+        self.responses = list(responses)
+        self.sent = []
+
+    def request(self, **kwargs):
+        self.sent.append(kwargs)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def make_client(responses: list, **config) -> SuiteTalkRestClient:
+    client = SuiteTalkRestClient({**CONFIG, **config}, logging.getLogger("test"))
+    client._session = FakeSession(responses)
+    return client
+
+
+def slots_in_use(client: SuiteTalkRestClient) -> int:
+    return client.governor.concurrency_limit - client.governor._semaphore._value
+
+
+def test_throttled_streamed_responses_are_closed_before_retrying():
+    throttled = [make_response(429, headers={"Retry-After": "0"}) for _ in range(3)]
+    page = make_response(200, {"items": [{"id": "1"}], "hasMore": False, "totalResults": 1})
+    client = make_client([*throttled, page])
+
+    success, error_message, rows = client._fetch_suiteql_page("SELECT id FROM customer", 0, 1000)
+
+    assert (success, error_message) == (True, None)
+    assert rows["items"] == [{"id": "1"}]
+    assert all(response.raw.closed for response in throttled)
+    assert slots_in_use(client) == 0
+
+
+def test_streamed_response_holds_its_slot_until_closed():
+    client = make_client([make_response(200, {"items": []})])
+
+    response = client._make_request(client.suiteql_url, "POST", data={"q": "SELECT id FROM customer"}, stream=True)
+    assert slots_in_use(client) == 1
+
+    response.close()
+    assert slots_in_use(client) == 0
+
+
+def test_post_write_is_not_retried_after_a_read_timeout():
+    client = make_client([requests.exceptions.ReadTimeout("read timed out"), make_response(204)])
+
+    record_id, success, error_message = client.create_record("customer", {"companyName": "Acme"})
+
+    assert not success
+    assert "ReadTimeout" in error_message
+    assert len(client._session.sent) == 1
+    assert slots_in_use(client) == 0
+
+
+def test_post_write_is_retried_after_a_connect_timeout():
+    created = make_response(204, headers={"Location": "https://example.com/record/v1/customer/42"})
+    client = make_client([requests.exceptions.ConnectTimeout("connect timed out"), created])
+
+    assert client.create_record("customer", {"companyName": "Acme"}) == ("42", True, None)
+    assert len(client._session.sent) == 2
+
+
+class SuiteQLSession:
+    """Answers SuiteQL pages from a list of rows per query, like NetSuite's `offset` / `limit` paging"""
+
+    def __init__(self, rows_by_query: dict) -> None:
+        self.rows_by_query = rows_by_query
+        self.pages = []
+
+    def request(self, **kwargs):
+        query = json.loads(kwargs["data"])["q"]
+        offset, limit = kwargs["params"]["offset"], kwargs["params"]["limit"]
+        self.pages.append((query, offset))
+        rows = self.rows_by_query[query]
+        page = rows[offset:offset + limit]
+        return make_response(200, {"items": page, "totalResults": len(rows), "hasMore": offset + limit < len(rows)})
+
+
+def test_small_lookup_is_a_single_query():
+    client = make_client([])
+
+    queries = client._plan_suiteql_queries("SELECT id FROM vendor", [("id", ["1", "2"]), ("externalId", ["'a'"])])
+
+    assert queries == ["SELECT id FROM vendor WHERE (id IN (1,2) OR externalId IN ('a'))"]
+
+
+def test_large_in_lists_are_chunked_within_the_statement_limits():
+    client = make_client([], suiteql_max_query_length=2000)
+    ids = [str(value) for value in range(2500)]
+    external_ids = [f"'external-{value}'" for value in range(10)]
+
+    queries = client._plan_suiteql_queries("SELECT id FROM vendor", [("id", ids), ("externalId", external_ids)], ["isinactive = 'F'"])
+
+    assert all(len(query) <= 2000 for query in queries)
+    assert all(query.startswith("SELECT id FROM vendor WHERE isinactive = 'F' AND (") for query in queries)
+    chunked_ids = [value for query in queries if "(id IN (" in query for value in query.split("(id IN (")[1].rstrip("))").split(",")]
+    assert chunked_ids == ids
+    assert sum(1 for query in queries if "externalId IN (" in query) == 1
+
+
+def test_in_lists_are_chunked_at_the_suiteql_limit():
+    client = make_client([])
+
+    chunks = client._chunk_in_list([str(value) for value in range(2001)], budget=10 ** 6)
+
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 1]
+
+
+def test_pages_are_fetched_in_parallel_and_returned_in_offset_order():
+    query = "SELECT id FROM customer"
+    rows = [{"id": str(value)} for value in range(2500)]
+    client = make_client([], ns_concurrency_limit=3)
+    client._session = SuiteQLSession({query: rows})
+
+    success, error_message, items = client._fetch_suiteql_rows(query)
+
+    assert (success, error_message) == (True, None)
+    assert items == rows
+    assert sorted(offset for _, offset in client._session.pages) == [0, 1000, 2000]
+    assert slots_in_use(client) == 0
+
+
+def test_queries_over_the_row_budget_fail():
+    query = "SELECT id FROM transactionLine"
+    client = make_client([])
+    client._session = SuiteQLSession({query: [{"id": str(value)} for value in range(1500)]})
+
+    success, error_message, items = client._fetch_suiteql_rows(query, max_rows=1000)
+
+    assert not success
+    assert "max_rows_per_query budget of 1000" in error_message
+    assert items == []
+
+
+def test_only_lookups_without_key_filters_have_a_row_budget():
+    client = make_client([], max_rows_per_query=500)
+
+    assert client._row_budget([]) == 500
+    assert client._row_budget([("t.id", ["1"])]) == 0
+
+
+def test_rows_matched_by_several_chunks_are_kept_once():
+    client = make_client([], ns_concurrency_limit=2)
+    client._session = SuiteQLSession({
+        "by id": [{"internalId": "1"}, {"internalId": "2"}],
+        "by external id": [{"internalId": "2"}, {"internalId": "3"}]
+    })
+
+    success, _, items = client._run_suiteql_queries(["by id", "by external id"], dedupe_key=client._internal_id_key)
+
+    assert success
+    assert items == [{"internalId": "1"}, {"internalId": "2"}, {"internalId": "3"}]
+
+
+class AsyncJobSession:
+    """Runs every submitted write as an async job that completes on its second poll"""
+
+    def __init__(self, results: dict) -> None:
+        self.results = results
+        self.polls = {}
+        self.submitted = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        if headers.get("Prefer") == "respond-async":
+            with self.lock:
+                job = f"https://example.com/async/v1/job/{len(self.submitted)}"
+                self.submitted.append((method, url, json.loads(data)))
+            return make_response(202, headers={"Location": job})
+        if url.endswith("/task"):
+            return make_response(200, {"items": [{"links": [{"rel": "self", "href": f"{url}/1"}]}]})
+        if url.endswith("/result"):
+            record = self.submitted[int(url.split("/job/")[1].split("/")[0])][2]
+            status_code, record_id = self.results[record["externalId"]]
+            if status_code >= 400:
+                return make_response(status_code, {"o:errorDetails": [{"detail": "Invalid field"}]})
+            return make_response(status_code, headers={"Location": f"https://example.com/record/v1/customer/{record_id}"})
+        with self.lock:
+            self.polls[url] = self.polls.get(url, 0) + 1
+            completed = self.polls[url] > 1
+        return make_response(200, {"completed": completed})
+
+
+def test_async_writes_are_submitted_at_once_and_polled_until_complete():
+    client = make_client([], async_poll_interval=0, async_poll_max_interval=0)
+    client._session = AsyncJobSession({"c-1": (204, "11"), "c-2": (204, "12"), "c-3": (400, None)})
+
+    results = client.write_records_async([
+        ("customer", None, {"externalId": "c-1"}),
+        ("customer", "12", {"externalId": "c-2"}),
+        ("customer", None, {"externalId": "c-3"})
+    ])
+
+    assert results[0] == ("11", True, None)
+    assert results[1] == ("12", True, None)
+    assert results[2][:2] == (None, False) and "Invalid field" in results[2][2]
+    assert sorted((record["externalId"], method, url.rsplit("/record/v1/", 1)[1]) for method, url, record in client._session.submitted) == [
+        ("c-1", "POST", "customer"), ("c-2", "PATCH", "customer/12"), ("c-3", "POST", "customer")
+    ]
+    assert all(polls == 2 for polls in client._session.polls.values())
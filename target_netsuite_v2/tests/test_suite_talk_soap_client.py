@@ -0,0 +1,71 @@
+import logging
+
+from types import SimpleNamespace
+
+from netsuitesdk import NetSuiteRateLimitError
+from target_netsuite_v2.governor import RequestGovernor
+from target_netsuite_v2.suite_talk_soap_client import SuiteTalkSoapClient
+
+
+def write_response(internal_id: str):
+    return SimpleNamespace(baseRef=SimpleNamespace(internalId=internal_id), status=SimpleNamespace(isSuccess=True))
+
+
+class FakeNetSuiteClient:
+    def __init__(self, outcomes: list) -> None:
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def request(self, operation, record):
+        self.requests.append((operation, record))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_client(outcomes: list, max_retries: int = 3) -> SuiteTalkSoapClient:
+    client = SuiteTalkSoapClient({}, logging.getLogger("test"), RequestGovernor(1, backoff_base=0, backoff_max=0), max_retries)
+    client._client = FakeNetSuiteClient(outcomes)
+    return client
+
+
+def test_rate_limited_write_is_retried():
+    rate_limited = NetSuiteRateLimitError("SuiteTalk concurrent request limit exceeded. Request blocked")
+    response = SimpleNamespace(body=SimpleNamespace(writeResponseList=SimpleNamespace(writeResponse=[write_response("1"), write_response("2")])))
+    client = make_client([rate_limited, rate_limited, response])
+
+    results = client._write_list("addList", ["first", "second"])
+
+    assert results == [("1", True, None), ("2", True, None)]
+    assert len(client._client.requests) == 3
+    assert client.governor.metrics["soap/addList"]["throttled"] == 2
+
+
+def test_rate_limited_write_fails_once_retries_are_exhausted():
+    rate_limited = NetSuiteRateLimitError("SuiteTalk concurrent request limit exceeded. Request blocked")
+    client = make_client([rate_limited, rate_limited], max_retries=1)
+
+    results = client._write_list("upsertList", ["record"])
+
+    assert results == [(None, False, "upsertList failed: SuiteTalk concurrent request limit exceeded. Request blocked")]
+    assert len(client._client.requests) == 2
+
+
+def test_other_errors_are_not_retried():
+    client = make_client([ValueError("Invalid record")])
+
+    assert client._write_list("addList", ["record"]) == [(None, False, "addList failed: Invalid record")]
+    assert len(client._client.requests) == 1
+
+
+def test_new_records_are_only_added_when_upserts_are_off():
+    def write(upsert: bool) -> list:
+        response = SimpleNamespace(body=SimpleNamespace(writeResponseList=SimpleNamespace(writeResponse=[write_response("1")])))
+        client = make_client([response, response])
+        client.build_record = lambda soap_record_type, record, record_id=None: record
+        client.write_records([("JournalEntry", "5", {"memo": "existing"}), ("JournalEntry", None, {"externalId": "je-1"})], upsert=upsert)
+        return [operation for operation, _ in client._client.requests]
+
+    assert write(upsert=True) == ["updateList", "upsertList"]
+    assert write(upsert=False) == ["updateList", "addList"]
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("hotglue_models_accounting")
+
+from target_netsuite_v2.target import TargetNetsuiteV2
+
+
+def make_target(*sinks):
+    # drain levels only read the active sinks, the target isn't started
+    target = TargetNetsuiteV2.__new__(TargetNetsuiteV2)
+    target._sinks_active = {sink.name: sink for sink in sinks}
+    return target
+
+
+def sink(name: str, *upstream_streams: str):
+    return SimpleNamespace(name=name, upstream_streams=list(upstream_streams))
+
+
+def level_names(target, sink_list: list) -> list:
+    return [[sink.name for sink in level] for level in target.drain_levels(sink_list)]
+
+
+def test_sinks_are_drained_after_the_sinks_they_reference():
+    vendors = sink("Vendors")
+    items = sink("Items")
+    bills = sink("Bills", "Vendors", "Items", "Accounts")
+    bill_payments = sink("BillPayments", "Bills", "Vendors", "Accounts")
+    target = make_target(bill_payments, bills, vendors, items)
+
+    assert level_names(target, [bill_payments, bills, vendors, items]) == [["Vendors", "Items"], ["Bills"], ["BillPayments"]]
+
+
+def test_sinks_outside_the_drained_list_are_ignored():
+    vendors = sink("Vendors")
+    bills = sink("Bills", "Vendors")
+    target = make_target(vendors, bills)
+
+    assert level_names(target, [bills]) == [["Bills"]]
+
+
+def test_reference_cycles_still_drain_every_sink():
+    customers = sink("Customers", "Invoices")
+    invoices = sink("Invoices", "Customers")
+    target = make_target(customers, invoices)
+
+    levels = level_names(target, [customers, invoices])
+
+    assert sorted(name for level in levels for name in level) == ["Customers", "Invoices"]